@@ -0,0 +1,78 @@
+"""
+Compares two benchmark result files written by `run.py`
+
+    python benchmarks/compare.py before.json after.json
+
+Prints the median time of every benchmark found in both files and the ratio
+after/before. Ratios beyond the threshold are marked as a regression or an
+improvement, and the exit status is 1 if any benchmark regressed.
+"""
+import argparse
+import json
+import sys
+
+
+def load(filename):
+    """ Returns the results of a file keyed by (name, size) """
+    with open(filename) as f:
+        results = json.load(f)
+    return {(r['name'], _size(r['params'])): r for r in results['results']}
+
+
+def _size(params):
+    """ Returns a short description of the benchmark parameters """
+    if set(params) == {'n_points', 'n_samples'}:
+        return '{n_points} x {n_samples}'.format(**params)
+    return ', '.join('{0}={1}'.format(k, v) for k, v in sorted(params.items()))
+
+
+def compare(before, after, threshold=0.1):
+    """ Returns the comparison rows of two sets of results
+
+    Each row is `(key, before_median, after_median, ratio, change)`, where
+    `change` is `regression`, `improvement` or an empty string. Benchmarks
+    that errored in either run have `None` medians and ratio.
+    """
+    rows = list()
+    for key in sorted(set(before) & set(after)):
+        old = before[key].get('median')
+        new = after[key].get('median')
+        ratio = None
+        change = ''
+        if old is None or new is None:
+            change = 'error'
+        else:
+            ratio = new/old
+            if ratio > 1 + threshold:
+                change = 'regression'
+            elif ratio < 1/(1 + threshold):
+                change = 'improvement'
+        rows.append((key, old, new, ratio, change))
+    return rows
+
+
+def _ms(value):
+    return '-' if value is None else '{0:.3f}'.format(value*1e3)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('before', help='baseline results file')
+    parser.add_argument('after', help='new results file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change reported as a regression or '
+                             'improvement (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    rows = compare(load(args.before), load(args.after), args.threshold)
+    print('{0:45s} {1:>12s} {2:>12s} {3:>12s} {4:>7s}'.format(
+        'benchmark', 'size', 'before (ms)', 'after (ms)', 'ratio'))
+    for (name, size), old, new, ratio, change in rows:
+        ratio = '-' if ratio is None else '{0:.2f}'.format(ratio)
+        print('{0:45s} {1:>12s} {2:>12s} {3:>12s} {4:>7s} {5}'.format(
+            name, size, _ms(old), _ms(new), ratio, change))
+    return int(any(row[-1] == 'regression' for row in rows))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
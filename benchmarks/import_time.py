@@ -0,0 +1,142 @@
+"""
+Import-time benchmark and guard for the `ftir` modules
+
+Every module is imported in a fresh interpreter, `repeat` times, and the
+import wall time is saved in the same json format as `run.py`, so it can be
+compared with `compare.py`:
+
+    python benchmarks/import_time.py -o imports.json
+
+Importing a module must not start a subprocess or load a plotting, GUI or
+widget library (see `FORBIDDEN`). The exit status is 1 if any module does.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+RESULTS_VERSION = 1
+
+MODULES = [
+    'ftir',
+    'ftir.spectra',
+    'ftir.modeling.area_norm',
+    'ftir.modeling.batch_fitting',
+    'ftir.modeling.buffer_subtraction',
+    'ftir.modeling.derivative',
+    'ftir.modeling.fit_cache',
+    'ftir.modeling.instrumentation',
+    'ftir.modeling.peak_definitions',
+    'ftir.modeling.peak_fitting',
+    'ftir.io.archive',
+    'ftir.io.cache',
+    'ftir.io.create_df',
+    'ftir.io.utils',
+]
+
+FORBIDDEN = ['matplotlib.pyplot', 'ipywidgets', 'plotly', 'tkinter',
+             'requests']
+
+# Runs in the fresh interpreter: records the subprocesses started and the
+# forbidden modules loaded while importing the module
+_CHILD = '''
+import json, subprocess, sys, time
+started = []
+_init = subprocess.Popen.__init__
+def _record(self, args, *a, **k):
+    started.append(str(args))
+    _init(self, args, *a, **k)
+subprocess.Popen.__init__ = _record
+before = set(sys.modules)
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = [m for m in {forbidden!r} if m in sys.modules and m not in before]
+print(json.dumps({{'time': elapsed, 'subprocesses': started,
+                  'forbidden': loaded}}))
+'''
+
+
+def import_module(module):
+    """ Imports a module in a fresh interpreter and returns its report """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p])
+    code = _CHILD.format(module=module, forbidden=FORBIDDEN)
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(repeat=5, progress=print):
+    """ Times the import of every module and returns json-ready results
+
+    Besides the timings, each result records the subprocesses started and
+    the forbidden modules loaded by the import.
+    """
+    results = list()
+    for module in MODULES:
+        record = {'name': 'import.' + module, 'params': {}}
+        try:
+            reports = [import_module(module) for _ in range(repeat)]
+        except subprocess.CalledProcessError as e:
+            record['error'] = 'import failed with status {0}'.format(
+                e.returncode)
+        else:
+            times = [report['time'] for report in reports]
+            record.update({
+                'times': times, 'min': min(times),
+                'median': float(np.median(times)),
+                'mean': float(np.mean(times)),
+                'subprocesses': reports[0]['subprocesses'],
+                'forbidden': reports[0]['forbidden']})
+        results.append(record)
+        if progress is not None:
+            progress(_format(record))
+    return {'version': RESULTS_VERSION, 'repeat': repeat,
+            'results': results}
+
+
+def violations(results):
+    """ Returns the modules that start a subprocess or load a forbidden
+    module on import
+    """
+    return [r['name'] for r in results['results']
+            if r.get('subprocesses') or r.get('forbidden')]
+
+
+def _format(record):
+    if 'error' in record:
+        return '{0:40s} error: {1}'.format(record['name'], record['error'])
+    problems = record['subprocesses'] + record['forbidden']
+    return '{0:40s} {1:10.1f} ms {2}'.format(
+        record['name'], record['median']*1e3,
+        'loads: ' + ', '.join(problems) if problems else '')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output', default=None,
+                        help='json file the results are written to')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='imports per module (default: 5)')
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1)
+        print('Results written to {0}'.format(args.output))
+    failed = violations(results)
+    if failed:
+        print('Imports with side effects: {0}'.format(', '.join(failed)))
+    return int(bool(failed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,376 @@
+"""
+Micro-benchmarks of the public `ftir.modeling` and `ftir.io` functions
+
+Each benchmark is timed on seeded synthetic spectra (see `synthetic.py`) over a
+grid of spectrum lengths and sample counts, and the timings are saved as json
+so two runs can be compared with `compare.py`:
+
+    python benchmarks/run.py -o before.json
+    ... change the code ...
+    python benchmarks/run.py -o after.json
+    python benchmarks/compare.py before.json after.json
+
+Everything runs offline on the CPU. Use `--quick` for a fast smoke run and
+`-k` to only run the benchmarks whose name contains a substring.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import scipy  # noqa: E402
+
+from synthetic import synthetic_spectra, synthetic_amide_one  # noqa: E402
+
+
+RESULTS_VERSION = 1
+
+# Spectrum lengths and sample counts of the full and the quick grids
+GRID = {'n_points': [1000, 3000, 12000], 'n_samples': [1, 8, 64]}
+QUICK_GRID = {'n_points': [1000], 'n_samples': [1, 8]}
+
+# Amide I spectra have a fixed length, only their number varies
+FIT_GRID = {'n_points': [106], 'n_samples': [1, 8]}
+QUICK_FIT_GRID = {'n_points': [106], 'n_samples': [1]}
+
+BENCHMARKS = []
+
+
+def benchmark(name, grid='spectra'):
+    """ Registers a benchmark
+
+    The decorated function takes the synthetic data and a temporary folder,
+    does any setup that should not be timed, and returns the zero argument
+    callable that is timed.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, grid, setup))
+        return setup
+    return register
+
+
+# --- ftir.modeling ----------------------------------------------------------
+
+@benchmark('modeling.buffer_subtract')
+def bench_buffer_subtract(df, tmp):
+    from ftir.modeling.buffer_subtraction import buffer_subtract
+    return lambda: buffer_subtract(df, baseline_min=1725, baseline_max=1735)
+
+
+@benchmark('modeling.area_norm')
+def bench_area_norm(df, tmp):
+    from ftir.modeling.area_norm import area_norm
+    return lambda: area_norm(df.drop(columns='buffer'))
+
+
+@benchmark('modeling.find_deriv')
+def bench_find_deriv(df, tmp):
+    from ftir.modeling.derivative import find_deriv
+    return lambda: find_deriv(df, flip=False)
+
+
+def _derivative(df):
+    from ftir.modeling.derivative import find_deriv
+    return find_deriv(df.drop(columns='buffer'), flip=True)
+
+
+@benchmark('modeling.sd_baseline_correction[min]')
+def bench_sd_baseline_min(df, tmp):
+    from ftir.modeling.derivative import sd_baseline_correction
+    deriv = _derivative(df)
+    return lambda: sd_baseline_correction(deriv, method='min')
+
+
+@benchmark('modeling.sd_baseline_correction[asym]')
+def bench_sd_baseline_asym(df, tmp):
+    from ftir.modeling.derivative import sd_baseline_correction
+    deriv = _derivative(df)
+    return lambda: sd_baseline_correction(deriv, method='asym')
+
+
+@benchmark('modeling.sd_baseline_correction[rubberband]')
+def bench_sd_baseline_rubberband(df, tmp):
+    from ftir.modeling.derivative import sd_baseline_correction
+    deriv = _derivative(df)
+    return lambda: sd_baseline_correction(deriv, method='rubberband')
+
+
+@benchmark('modeling.rubberband_baseline[convex]')
+def bench_rubberband_baseline_convex(df, tmp):
+    from ftir.modeling.derivative import rubberband_baseline
+    # Convex spectra, where every point but the last is a hull vertex
+    x = np.arange(len(df), dtype=float)
+    y = np.repeat(((x / len(x))**2)[:, None], df.shape[1] - 2, axis=1)
+    y[-1] = -10
+    return lambda: rubberband_baseline(x, y)
+
+
+@benchmark('modeling.asym_baseline')
+def bench_asym_baseline(df, tmp):
+    from ftir.modeling.derivative import asym_baseline
+    y = df.iloc[:, 2:].to_numpy()
+    return lambda: asym_baseline(y)
+
+
+@benchmark('modeling.gaussian_sum')
+def bench_gaussian_sum(df, tmp):
+    from ftir.modeling.peak_definitions import yang_h20_2015
+    from ftir.modeling.peak_fitting import gaussian_sum
+    x = df['freq'].to_numpy()
+    means = yang_h20_2015['means']
+    args = np.column_stack([np.full(len(means), 0.05), means,
+                            np.full(len(means), 4.0)]).ravel()
+    n_samples = df.shape[1] - 2
+    return lambda: [gaussian_sum(x, *args) for _ in range(n_samples)]
+
+
+@benchmark('modeling.gaussian_least_squares', grid='fit')
+def bench_gaussian_least_squares(df, tmp):
+    from ftir.modeling.peak_fitting import gaussian_least_squares
+    cols = df.columns[1:]
+    return lambda: [gaussian_least_squares(df[['freq', col]], col)
+                    for col in cols]
+
+
+@benchmark('modeling.gaussian_least_squares[truncate]')
+def bench_gaussian_least_squares_truncate(df, tmp):
+    from ftir.modeling.peak_fitting import gaussian_least_squares
+    # One full range spectrum, where the windowed Jacobian pays off
+    col = df.columns[2]
+    spectrum = pd.DataFrame({'freq': df['freq'],
+                             col: df[col] - df['buffer']})
+    return lambda: gaussian_least_squares(spectrum, col, truncate=6)
+
+
+@benchmark('modeling.guess_heights')
+def bench_guess_heights(df, tmp):
+    from ftir.modeling.peak_definitions import yang_h20_2015
+    from ftir.modeling.peak_fitting import guess_heights
+    cols = list(df.columns[1:])
+    return lambda: guess_heights(df, cols, yang_h20_2015['means'])
+
+
+@benchmark('modeling.gaussian_minimize', grid='fit')
+def bench_gaussian_minimize(df, tmp):
+    from ftir.modeling.peak_fitting import gaussian_minimize
+    cols = df.columns[1:]
+    return lambda: [gaussian_minimize(df[['freq', col]], col)
+                    for col in cols]
+
+
+@benchmark('modeling.gaussian_variable_projection', grid='fit')
+def bench_gaussian_variable_projection(df, tmp):
+    from ftir.modeling.peak_fitting import gaussian_variable_projection
+    cols = df.columns[1:]
+    return lambda: [gaussian_variable_projection(df[['freq', col]], col)
+                    for col in cols]
+
+
+@benchmark('modeling.gaussian_multistart', grid='fit')
+def bench_gaussian_multistart(df, tmp):
+    from ftir.modeling.peak_fitting import gaussian_multistart
+    cols = df.columns[1:]
+    return lambda: [gaussian_multistart(df[['freq', col]], col, seed=0)
+                    for col in cols]
+
+
+@benchmark('modeling.gaussian_differential_evolution', grid='fit')
+def bench_gaussian_differential_evolution(df, tmp):
+    from ftir.modeling.peak_fitting import gaussian_differential_evolution
+    cols = df.columns[1:]
+    return lambda: [gaussian_differential_evolution(df[['freq', col]], col,
+                                                    params={'seed': 0})
+                    for col in cols]
+
+
+@benchmark('modeling.fit_all', grid='fit')
+def bench_fit_all(df, tmp):
+    from ftir.modeling.batch_fitting import fit_all
+    return lambda: fit_all(df, workers=1)
+
+
+@benchmark('modeling.fit_series', grid='fit')
+def bench_fit_series(df, tmp):
+    from ftir.modeling.batch_fitting import fit_series
+    return lambda: fit_series(df)
+
+
+@benchmark('modeling.fit_global', grid='fit')
+def bench_fit_global(df, tmp):
+    from ftir.modeling.batch_fitting import fit_global
+    return lambda: fit_global(df)
+
+
+# --- ftir.io ----------------------------------------------------------------
+
+@benchmark('io.create_df_from_single_file')
+def bench_create_df_from_single_file(df, tmp):
+    from ftir.io.utils import create_df_from_single_file
+    df.to_csv(os.path.join(tmp, 'spectra.csv'), index=False)
+    return lambda: create_df_from_single_file('spectra.csv', tmp)
+
+
+@benchmark('io.create_df_from_multiple_files')
+def bench_create_df_from_multiple_files(df, tmp):
+    from ftir.io.utils import create_df_from_multiple_files
+    filenames = list()
+    for col in df.columns[1:]:
+        filename = os.path.join(tmp, '{0}.csv'.format(col))
+        df[['freq', col]].to_csv(filename, index=False, header=False)
+        filenames.append(filename)
+    return lambda: create_df_from_multiple_files(filenames)
+
+
+@benchmark('io.excel_df', grid='fit')
+def bench_excel_df(df, tmp):
+    from ftir.io.create_df import excel_df
+    df.to_excel(os.path.join(tmp, 'spectra.xlsx'), index=False)
+    return lambda: excel_df('excel', tmp, 'spectra.xlsx')
+
+
+@benchmark('io.SpectraCache.get')
+def bench_spectra_cache_get(df, tmp):
+    from ftir.io.cache import SpectraCache
+    from ftir.io.utils import create_df_from_single_file
+    df.to_csv(os.path.join(tmp, 'spectra.csv'), index=False)
+    cache = SpectraCache(os.path.join(tmp, 'cache'))
+    create_df_from_single_file('spectra.csv', tmp, cache=cache)
+    return lambda: create_df_from_single_file('spectra.csv', tmp, cache=cache)
+
+
+@benchmark('io.SpectralArchive.select')
+def bench_archive_select(df, tmp):
+    from ftir.io.archive import SpectralArchive
+    archive = SpectralArchive.create(os.path.join(tmp, 'archive'), df['freq'])
+    archive.append_dataframe(df)
+    names = list(df.columns[1::2])
+    return lambda: archive.select(names).values.sum()
+
+
+# --- runner -----------------------------------------------------------------
+
+def _time(func, repeat):
+    """ Returns the wall times of `repeat` calls, after one warm up call """
+    func()
+    times = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run_benchmark(name, setup, data, repeat):
+    """ Runs one benchmark on one data set and returns its result record """
+    n_points = len(data)
+    n_samples = data.shape[1] - 1 - ('buffer' in data)
+    record = {'name': name,
+              'params': {'n_points': n_points, 'n_samples': n_samples}}
+    tmp = tempfile.mkdtemp(prefix='ftir-bench-')
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            times = _time(setup(data.copy(), tmp), repeat)
+    except Exception as e:
+        record['error'] = '{0}: {1}'.format(type(e).__name__, e)
+        return record
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    record.update({'times': times, 'min': min(times),
+                   'median': float(np.median(times)),
+                   'mean': float(np.mean(times))})
+    return record
+
+
+def environment():
+    """ Returns a description of the machine and library versions """
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__, 'scipy': scipy.__version__,
+            'pandas': pd.__version__,
+            'date': datetime.datetime.now().isoformat(timespec='seconds')}
+
+
+def run(select=None, quick=False, repeat=5, seed=0, progress=print):
+    """ Runs the benchmarks and returns the results as a json-ready dict
+
+    Parameters
+    ----------
+    select : Str (optional)
+        Only run the benchmarks whose name contains this substring
+
+    quick : bool (default: False)
+        Use the small quick grid of spectrum lengths and sample counts
+
+    repeat : Int (default: 5)
+        Number of timed calls per benchmark and data set
+
+    seed : Int (default: 0)
+        Seed of the synthetic spectra
+
+    progress : Callable (default: print)
+        Called with a line of text for each finished benchmark, or `None`
+    """
+    grids = {'spectra': QUICK_GRID if quick else GRID,
+             'fit': QUICK_FIT_GRID if quick else FIT_GRID}
+    generators = {'spectra': synthetic_spectra, 'fit': synthetic_amide_one}
+    results = list()
+    for name, grid, setup in BENCHMARKS:
+        if select is not None and select not in name:
+            continue
+        for n_points in grids[grid]['n_points']:
+            for n_samples in grids[grid]['n_samples']:
+                data = generators[grid](n_points=n_points,
+                                        n_samples=n_samples, seed=seed)
+                record = run_benchmark(name, setup, data, repeat)
+                results.append(record)
+                if progress is not None:
+                    progress(_format(record))
+    return {'version': RESULTS_VERSION, 'seed': seed, 'repeat': repeat,
+            'environment': environment(), 'results': results}
+
+
+def _format(record):
+    params = '{n_points} x {n_samples}'.format(**record['params'])
+    if 'error' in record:
+        timing = 'error: ' + record['error']
+    else:
+        timing = '{0:10.3f} ms'.format(record['median']*1e3)
+    return '{0:45s} {1:>12s} {2}'.format(record['name'], params, timing)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-o', '--output', default='benchmarks.json',
+                        help='json file the results are written to')
+    parser.add_argument('-k', dest='select', default=None,
+                        help='only run benchmarks containing this substring')
+    parser.add_argument('--quick', action='store_true',
+                        help='run on a small grid of data sizes')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed calls per benchmark (default: 5)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic spectra (default: 0)')
+    args = parser.parse_args(argv)
+
+    results = run(args.select, args.quick, args.repeat, args.seed)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=1)
+    print('Results written to {0}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
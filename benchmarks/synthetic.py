@@ -0,0 +1,112 @@
+"""
+Seeded generator of synthetic FTIR absorbance spectra
+
+The spectra are built from the same ingredients as measured protein
+formulations: a protein Amide I band made of Gaussian components at the means
+of a peak definition, an Amide II band, the water bending and stretching bands
+of the buffer, a sloping background, and white noise. The same seed always
+gives the same spectra, so benchmark runs on different machines or commits
+time the same work.
+"""
+import numpy as np
+import pandas as pd
+
+from ftir.modeling.peak_definitions import yang_h20_2015
+
+
+# Water bands of the buffer as (center, height, width)
+WATER_BANDS = [(1643, 0.9, 38), (2125, 0.08, 90), (3400, 2.5, 240)]
+
+AMIDE_II = (1545, 0.35, 22)
+
+
+def _bands(freq, bands):
+    """ Returns the sum of the Gaussian bands evaluated at `freq` """
+    centers, heights, widths = (np.asarray(v, dtype=float)[:, None]
+                                for v in zip(*bands))
+    return (heights * np.exp(-(freq - centers)**2/(2*widths**2))).sum(axis=0)
+
+
+def synthetic_spectra(n_points=3000, n_samples=8, min_freq=1000,
+                      max_freq=3999, peaks=yang_h20_2015, peak_width=4,
+                      noise=1e-4, buffer_scale=(0.95, 1.05), seed=0):
+    """ Returns a DataFrame of synthetic absorbance spectra
+
+    Parameters
+    ----------
+    n_points : Int (default: 3000)
+        Number of frequency points, evenly spaced over the frequency range
+
+    n_samples : Int (default: 8)
+        Number of sample spectra
+
+    min_freq, max_freq : Number (default: 1000, 3999)
+        Frequency range of the spectra
+
+    peaks : Peak Definitions (optional)
+        Peak definitions whose means are used as the Amide I component
+        centers. Defaults to the Yang et. al, Nature Protocol 2015. peak
+        definitions.
+
+    peak_width : Number (default: 4)
+        Mean width of the Amide I components
+
+    noise : Float (default: 1e-4)
+        Standard deviation of the white noise added to every spectrum
+
+    buffer_scale : Tuple (default: (0.95, 1.05))
+        Range of the amount of buffer contained in each sample
+
+    seed : Int (default: 0)
+        Seed of the random number generator
+
+    Returns
+    -------
+    DataFrame
+        The frequency in the first column (`freq`, descending like the
+        instrument exports), the buffer spectrum in the second column
+        (`buffer`), followed by one column per sample (`sample_<i>`).
+    """
+    rng = np.random.default_rng(seed)
+    freq = np.linspace(max_freq, min_freq, n_points)
+
+    background = 0.02 + 0.01*(freq - min_freq)/(max_freq - min_freq)
+    buffer = _bands(freq, WATER_BANDS) + background
+    buffer += rng.normal(0, noise, n_points)
+
+    means = np.asarray(peaks['means'], dtype=float)
+    n_peaks = len(means)
+    data = {'freq': freq, 'buffer': buffer}
+    for i in range(n_samples):
+        heights = rng.uniform(0.02, 0.12, n_peaks)
+        centers = means + rng.uniform(-0.5, 0.5, n_peaks)
+        widths = peak_width*rng.uniform(0.8, 1.2, n_peaks)
+        protein = _bands(freq, list(zip(centers, heights, widths)))
+        protein += _bands(freq, [AMIDE_II])*rng.uniform(0.8, 1.2)
+        sample = rng.uniform(*buffer_scale)*buffer + protein
+        sample += rng.normal(0, noise, n_points)
+        data['sample_{0}'.format(i)] = sample
+    return pd.DataFrame(data)
+
+
+def synthetic_amide_one(n_points=106, n_samples=8, peaks=yang_h20_2015,
+                        peak_width=4, noise=1e-4, seed=0):
+    """ Returns synthetic Amide I spectra ready for peak fitting
+
+    The spectra are the sum of Gaussian components at the peak definition
+    means between 1600 and 1705 cm-1, plus white noise, without any buffer
+    or background. The DataFrame holds the frequency in the first column
+    followed by one column per sample.
+    """
+    rng = np.random.default_rng(seed)
+    freq = np.linspace(1705, 1600, n_points)
+    means = np.asarray(peaks['means'], dtype=float)
+    data = {'freq': freq}
+    for i in range(n_samples):
+        heights = rng.uniform(0.02, 0.12, len(means))
+        centers = means + rng.uniform(-0.5, 0.5, len(means))
+        widths = peak_width*rng.uniform(0.8, 1.2, len(means))
+        spectrum = _bands(freq, list(zip(centers, heights, widths)))
+        data['sample_{0}'.format(i)] = (
+            spectrum + rng.normal(0, noise, n_points))
+    return pd.DataFrame(data)
@@ -1,26 +1,30 @@
 """ Top level package to support ftir data analysis application
 """
 from os.path import dirname, isfile, join
-from subprocess import check_output
 from collections import namedtuple
 
 __version__ = "0.0.0.dev0"
 
 
-try:
-    _build_file = join(dirname(__file__), "build.txt")
-    if isfile(_build_file):
-        with open(_build_file) as f:
-            __build__ = f.read().strip()
-    else:
+def _get_build():
+    """ Returns the build number from `build.txt`, or the git hash on a
+    development machine.
+    """
+    try:
+        _build_file = join(dirname(__file__), "build.txt")
+        if isfile(_build_file):
+            with open(_build_file) as f:
+                return f.read().strip()
         # If no build file, we are on a dev machine: display the git hash
         # instead:
-        git_hash = check_output("git rev-parse --short HEAD", shell=True)
-        __build__ = git_hash.strip()
-except Exception as e:
-    msg = "Exception while trying to collect the build number. Error was {}"
-    print(msg.format(e))
-    __build__ = "XX"
+        from subprocess import check_output, DEVNULL
+        git_hash = check_output(["git", "rev-parse", "--short", "HEAD"],
+                                cwd=dirname(__file__), stderr=DEVNULL)
+        return git_hash.decode().strip()
+    except Exception as e:
+        msg = "Exception while trying to collect the build number. Error was {}"
+        print(msg.format(e))
+        return "XX"
 
 
 # API version of the version:
@@ -34,4 +38,17 @@ def _repr_version_info(self):
 
 _VersionInfo.__repr__ = _repr_version_info
 
-version_info = _VersionInfo(__version__, __build__)
+
+def __getattr__(name):
+    """ Resolves `__build__` and `version_info` on first access, so importing
+    the package never reads files or starts a subprocess.
+    """
+    if name == "__build__":
+        value = _get_build()
+    elif name == "version_info":
+        value = _VersionInfo(__version__, __getattr__("__build__"))
+    else:
+        raise AttributeError(
+            "module {!r} has no attribute {!r}".format(__name__, name))
+    globals()[name] = value
+    return value
@@ -0,0 +1,430 @@
+"""
+Command line interface for headless batch processing
+
+The `ftir` command runs the full processing pipeline of the notebooks without
+any dialogs or widgets:
+
+    load -> area_norm -> find_deriv -> sd_baseline_correction -> area_norm
+         -> peak fit -> secondary_structure
+
+Example
+-------
+Process every csv and Excel file of a folder on all cores, and write one
+results table:
+
+    ftir process data/plate_01 -o plate_01_results.csv
+
+Glob patterns, several inputs and a json configuration file are supported:
+
+    ftir process "data/*/*.csv" --config pipeline.json -o results.csv
+
+`ftir watch` keeps polling a folder and only processes new or changed files
+(see `ftir.watch`):
+
+    ftir watch /shared/ftir_exports -o results.csv
+
+The configuration file holds the same settings as the command line options,
+e.g. `{"window_length": 25, "baseline_method": "rubberband",
+"method": "least_squares", "params": {"loss": "linear"}}`. Options given on
+the command line take precedence.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+
+EXTENSIONS = ('.csv', '.xlsx', '.xls')
+
+# Pipeline settings and their defaults, following `mms_processing.ipynb`
+DEFAULTS = {
+    'window_length': 25,
+    'flip': True,
+    'baseline_method': 'rubberband',
+    'bounds': [1620, 1700],
+    'method': 'least_squares',
+    'peaks': 'yang_h20_2015',
+    'peak_width': 5,
+    'params': None,
+    'workers': None,
+    'cache': None,
+}
+
+
+def find_files(inputs):
+    """ Returns the sorted data files of a list of files, folders and glob
+    patterns. Folders and patterns contribute their csv and Excel files.
+    """
+    files = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name)
+                       for name in os.listdir(pattern)]
+        elif glob.has_magic(pattern):
+            matches = glob.glob(pattern)
+        else:
+            files.add(pattern)
+            continue
+        files.update(path for path in matches if os.path.isfile(path) and
+                     path.lower().endswith(EXTENSIONS))
+    return sorted(files)
+
+
+def load_spectra(path, cache=None):
+    """ Returns a DataFrame of the spectra in a csv or Excel file
+
+    The first column holds the frequency data and the remaining columns one
+    spectrum each. csv files are read with `create_df_from_single_file`,
+    Excel files with `excel_df` (without peak normalization).
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    if name.lower().endswith(('.xlsx', '.xls')):
+        from ftir.io.create_df import excel_df
+        df, _, _ = excel_df('excel', folder, name, max_pk_normalize=False,
+                            cache=cache)
+    else:
+        from ftir.io.utils import create_df_from_single_file
+        df, _ = create_df_from_single_file(name, folder, cache=cache)
+    return df
+
+
+def preprocess(df, window_length=25, flip=True, baseline_method='rubberband',
+               bounds=(1620, 1700)):
+    """ Returns the area normalized, baseline corrected second derivative
+    spectra of a DataFrame of absorbance spectra, ready for peak fitting
+    """
+    from ftir.modeling.area_norm import area_norm
+    from ftir.modeling.derivative import find_deriv, sd_baseline_correction
+
+    df = area_norm(df)
+    df = find_deriv(df, flip=flip, window_length=window_length)
+    df = sd_baseline_correction(df, method=baseline_method,
+                                bounds=list(bounds))
+    return area_norm(df)
+
+
+def _spectra_cache(cache):
+    """ Returns the spectra cache folder of a pipeline cache folder """
+    return None if cache is None else os.path.join(cache, 'spectra')
+
+
+def _fit_cache(cache):
+    """ Returns the fit cache of a pipeline cache folder """
+    if cache is None:
+        return None
+    from ftir.modeling.fit_cache import FitCache
+    return FitCache(directory=os.path.join(cache, 'fits'))
+
+
+def _process_file(path, settings):
+    """ Loads and preprocesses one file. Worker function of `process`. """
+    try:
+        df = load_spectra(path, cache=_spectra_cache(settings['cache']))
+        return preprocess(df, settings['window_length'], settings['flip'],
+                          settings['baseline_method'], settings['bounds'])
+    except Exception as e:
+        return e
+
+
+def _peak_definitions(peaks):
+    """ Returns peak definitions given as a dict or by name """
+    if isinstance(peaks, dict):
+        return peaks
+    from ftir.modeling import peak_definitions
+    try:
+        return getattr(peak_definitions, peaks)
+    except AttributeError:
+        raise NameError('name {0} is not a peak definition of '
+                        'ftir.modeling.peak_definitions'.format(peaks))
+
+
+def _fit_files(freq, frames, settings, peaks, cache):
+    """ Fits the samples of files sharing the frequency axis `freq` """
+    from ftir.modeling.batch_fitting import fit_all
+    from ftir.spectra import SpectraSet
+
+    names = [(path, sample) for path, df in frames
+             for sample in df.columns[1:]]
+    values = np.column_stack([df.iloc[:, 1:].to_numpy(dtype=float)
+                              for _, df in frames])
+    results = fit_all(SpectraSet(freq, values), method=settings['method'],
+                      peaks=peaks, peak_width=settings['peak_width'],
+                      params=settings['params'],
+                      workers=settings['workers'], cache=cache)
+    results.insert(0, 'file', [path for path, _ in names])
+    results.insert(1, 'sample', [sample for _, sample in names])
+    return results
+
+
+def fit_spectra(spectra, settings):
+    """ Fits preprocessed spectra of one or more files
+
+    Files sharing a frequency axis are fit together. If such a fit fails,
+    the files are fit one at a time, so only the files that cannot be fit
+    are left out of the results.
+
+    Parameters
+    ----------
+    spectra : Dict
+        Preprocessed DataFrame of each file, keyed by file path
+
+    settings : Dict
+        Pipeline settings, see `DEFAULTS`
+
+    Returns
+    -------
+    Tuple
+        The `fit_all` results of every sample, with the `file` and `sample`
+        name in the first columns, and a dict of the files that could not
+        be fit and their error.
+    """
+    # Fit files sharing a frequency axis together, so the process pool is
+    # shared by all their samples
+    groups = dict()
+    for path, df in spectra.items():
+        freq = df.iloc[:, 0].to_numpy(dtype=float)
+        groups.setdefault(freq.tobytes(), (freq, []))[1].append((path, df))
+
+    peaks = _peak_definitions(settings['peaks'])
+    cache = _fit_cache(settings['cache'])
+    tables = list()
+    errors = dict()
+    for freq, frames in groups.values():
+        try:
+            tables.append(_fit_files(freq, frames, settings, peaks, cache))
+            continue
+        except Exception as e:
+            if len(frames) == 1:
+                errors[frames[0][0]] = e
+                continue
+        for frame in frames:
+            try:
+                tables.append(_fit_files(freq, [frame], settings, peaks,
+                                         cache))
+            except Exception as e:
+                errors[frame[0]] = e
+    if not tables:
+        return pd.DataFrame(columns=['file', 'sample']), errors
+    return pd.concat(tables, ignore_index=True), errors
+
+
+def _preprocess_files(files, settings):
+    """ Yields each file path and its preprocessed DataFrame or error """
+    workers = settings['workers'] or os.cpu_count() or 1
+    if workers == 1 or len(files) <= 1:
+        for path in files:
+            yield path, _process_file(path, settings)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(files))) as ex:
+        for item in zip(files, ex.map(_process_file, files,
+                                      [settings]*len(files))):
+            yield item
+
+
+def process(files, settings, progress=None):
+    """ Runs the pipeline on data files and returns the results table
+
+    Files are loaded and preprocessed in parallel, then all their samples
+    are fit in parallel with `fit_all`.
+
+    Parameters
+    ----------
+    files : list
+        Paths of the data files
+
+    settings : Dict
+        Pipeline settings, see `DEFAULTS`. Missing settings use the defaults.
+
+    progress : Callable (optional)
+        Called with a message for each processed file and each error
+
+    Returns
+    -------
+    Tuple
+        The results DataFrame of every sample (see `fit_spectra`), and a
+        dict of the files that could not be loaded, preprocessed or fit and
+        their error.
+    """
+    settings = dict(DEFAULTS, **settings)
+    spectra = dict()
+    errors = dict()
+    for path, result in _preprocess_files(files, settings):
+        if isinstance(result, Exception):
+            errors[path] = result
+            message = 'Error: {0}: {1}'.format(path, result)
+        else:
+            spectra[path] = result
+            message = 'Loaded {0} ({1} samples)'.format(
+                path, result.shape[1] - 1)
+        if progress is not None:
+            progress(message)
+    results, fit_errors = fit_spectra(spectra, settings)
+    for path, error in fit_errors.items():
+        errors[path] = error
+        if progress is not None:
+            progress('Error: {0}: {1}'.format(path, error))
+    return results, errors
+
+
+def write_results(results, output):
+    """ Writes a results table to a csv or json file, by file extension """
+    results = results.drop(columns='x', errors='ignore')
+    if output.lower().endswith('.json'):
+        results.to_json(output, orient='records', indent=1)
+    else:
+        results.to_csv(output, index=False)
+
+
+def _settings(args):
+    """ Returns the pipeline settings of the parsed command line arguments """
+    settings = dict()
+    if args.config is not None:
+        with open(args.config) as f:
+            settings.update(json.load(f))
+    unknown = set(settings) - set(DEFAULTS)
+    if unknown:
+        raise ValueError('Unknown settings in {0}: {1}'.format(
+            args.config, ', '.join(sorted(unknown))))
+    for name in DEFAULTS:
+        value = getattr(args, name, None)
+        if value is not None:
+            settings[name] = value
+    if isinstance(settings.get('params'), str):
+        settings['params'] = json.loads(settings['params'])
+    return dict(DEFAULTS, **settings)
+
+
+def _add_pipeline_arguments(parser):
+    """ Adds the pipeline settings options to a parser """
+    parser.add_argument('--config', help='json file of pipeline settings')
+    parser.add_argument('--window-length', dest='window_length', type=int,
+                        help='second derivative filter window length '
+                             '(default: 25)')
+    parser.add_argument('--no-flip', dest='flip', action='store_false',
+                        default=None,
+                        help='do not flip the second derivative spectra')
+    parser.add_argument('--baseline-method', dest='baseline_method',
+                        choices=['min', 'asym', 'rubberband'],
+                        help='second derivative baseline correction method '
+                             '(default: rubberband)')
+    parser.add_argument('--bounds', type=float, nargs=2,
+                        metavar=('MIN', 'MAX'),
+                        help='frequency range of the baseline correction and '
+                             'of the fit (default: 1620 1700)')
+    parser.add_argument('--method',
+                        help='fitting method: least_squares, minimize, '
+                             'differential_evolution, variable_projection or '
+                             'multistart (default: least_squares)')
+    parser.add_argument('--peaks',
+                        help='peak definitions name in '
+                             'ftir.modeling.peak_definitions '
+                             '(default: yang_h20_2015)')
+    parser.add_argument('--peak-width', dest='peak_width', type=float,
+                        help='maximum peak width (default: 5)')
+    parser.add_argument('--params',
+                        help='json dict of solver parameters, e.g. '
+                             '\'{"loss": "linear"}\'')
+    parser.add_argument('-j', '--workers', type=int,
+                        help='number of worker processes (default: number '
+                             'of CPUs)')
+    parser.add_argument('--cache',
+                        help='folder caching parsed files and fit results '
+                             'between runs')
+
+
+def _process_command(args):
+    files = find_files(args.inputs)
+    if not files:
+        print('No data files found', file=sys.stderr)
+        return 1
+    settings = _settings(args)
+    progress = None if args.quiet else (
+        lambda message: print(message, file=sys.stderr))
+    results, errors = process(files, settings, progress)
+    if args.quiet:
+        for path, error in errors.items():
+            print('Error: {0}: {1}'.format(path, error), file=sys.stderr)
+    write_results(results, args.output)
+    if not args.quiet:
+        print('Wrote {0} results to {1}'.format(len(results), args.output),
+              file=sys.stderr)
+    return int(bool(errors))
+
+
+def _watch_command(args):
+    from ftir.watch import FolderWatcher
+
+    progress = None if args.quiet else (
+        lambda message: print(message, file=sys.stderr))
+    watcher = FolderWatcher(args.inputs, args.output, _settings(args),
+                            manifest=args.manifest, interval=args.interval,
+                            settle=args.settle, progress=progress)
+    watcher.run(once=args.once)
+    return 0
+
+
+def build_parser():
+    """ Returns the argument parser of the `ftir` command """
+    parser = argparse.ArgumentParser(
+        prog='ftir', description='Headless FTIR batch processing')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser(
+        'process', help='process data files into one results table',
+        description='Runs load, area_norm, find_deriv, '
+                    'sd_baseline_correction, area_norm, the peak fit and '
+                    'secondary_structure on every sample of the input '
+                    'files, and writes one results table.')
+    command.add_argument('inputs', nargs='+',
+                         help='data files, folders or glob patterns')
+    command.add_argument('-o', '--output', default='ftir_results.csv',
+                         help='results file, csv or json '
+                              '(default: ftir_results.csv)')
+    command.add_argument('-q', '--quiet', action='store_true',
+                         help='only report errors')
+    _add_pipeline_arguments(command)
+    command.set_defaults(func=_process_command)
+
+    command = commands.add_parser(
+        'watch', help='process new or changed files as they arrive',
+        description='Polls the inputs and runs the pipeline on new or '
+                    'changed files only, appending their results to a csv '
+                    'results store. A manifest of the processed files makes '
+                    'restarts cheap.')
+    command.add_argument('inputs', nargs='+',
+                         help='folders, files or glob patterns to watch')
+    command.add_argument('-o', '--output', default='ftir_results.csv',
+                         help='csv results store (default: '
+                              'ftir_results.csv)')
+    command.add_argument('--manifest',
+                         help='manifest of the processed files (default: '
+                              'OUTPUT with a .manifest.json suffix)')
+    command.add_argument('--interval', type=float, default=10,
+                         help='seconds between polls (default: 10)')
+    command.add_argument('--settle', type=float, default=2,
+                         help='seconds a file must be unmodified before it '
+                              'is processed (default: 2)')
+    command.add_argument('--once', action='store_true',
+                         help='process the pending files once and exit, '
+                              'e.g. from cron')
+    command.add_argument('-q', '--quiet', action='store_true',
+                         help='do not report processed files')
+    _add_pipeline_arguments(command)
+    command.set_defaults(func=_watch_command)
+    return parser
+
+
+def main(argv=None):
+    """ Entry point of the `ftir` command """
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
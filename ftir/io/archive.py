@@ -0,0 +1,244 @@
+""" Append-only, memory-mapped archive for large collections of spectra
+
+Stability studies accumulate tens of thousands of spectra measured on the same
+frequency axis. A `SpectralArchive` is a folder holding:
+
+    archive.json
+        Format version, data type and number of frequency points
+    freq.npy
+        The shared frequency axis
+    spectra.dat
+        Raw float matrix with one row per sample, appended to as samples are
+        added
+    index.jsonl
+        One json line of metadata per sample (at least its `name`), in the
+        same order as the rows of `spectra.dat`
+
+The spectra are memory-mapped, so selecting samples by name, date or other
+metadata only reads the selected rows from disk. Selections are returned as a
+`SpectraSet`, which can be passed directly to the modeling functions.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from ftir.spectra import SpectraSet, _as_slice
+
+
+ARCHIVE_VERSION = 1
+
+DTYPE = '<f8'
+
+
+class SpectralArchive(object):
+    """ Append-only archive of spectra sharing one frequency axis
+
+    Use `SpectralArchive.create` to start a new archive, and
+    `SpectralArchive(directory)` to open an existing one.
+
+    Parameters
+    ----------
+    directory : Str
+        Folder of an existing archive
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(self._path('archive.json')) as f:
+            header = json.load(f)
+        if header['version'] > ARCHIVE_VERSION:
+            raise ValueError('Archive version {0} is not supported'
+                             ''.format(header['version']))
+        self.dtype = np.dtype(header['dtype'])
+        self.freq = np.load(self._path('freq.npy'))
+        self._matrix = None
+        self.refresh()
+
+    @classmethod
+    def create(cls, directory, freq):
+        """ Creates an empty archive for spectra measured at `freq` """
+        freq = np.asarray(freq, dtype=float)
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(os.path.join(directory, 'archive.json')):
+            raise ValueError('An archive already exists in {0}'
+                             ''.format(directory))
+        np.save(os.path.join(directory, 'freq.npy'), freq)
+        open(os.path.join(directory, 'spectra.dat'), 'wb').close()
+        open(os.path.join(directory, 'index.jsonl'), 'w').close()
+        with open(os.path.join(directory, 'archive.json'), 'w') as f:
+            json.dump({'version': ARCHIVE_VERSION, 'dtype': DTYPE,
+                       'n_points': len(freq)}, f)
+        return cls(directory)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def refresh(self):
+        """ Re-reads the sample index, e.g. after another process appended
+        spectra. The index is the commit point of an append: rows of
+        `spectra.dat` without an index line, and a last index line without
+        its newline, are ignored.
+        """
+        with open(self._path('index.jsonl'), 'rb') as f:
+            content = f.read()
+        committed = content[:content.rfind(b'\n') + 1]
+        records = list()
+        for number, line in enumerate(committed.decode().splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                raise ValueError('Line {0} of the archive index {1} is not '
+                                 'valid json'.format(
+                                     number, self._path('index.jsonl')))
+        self._index_size = len(committed)
+        self.index = pd.DataFrame.from_records(records)
+        if 'name' not in self.index:
+            self.index['name'] = pd.Series(dtype=object)
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __repr__(self):
+        return '<SpectralArchive: {0} samples x {1} points at {2}>'.format(
+            len(self), len(self.freq), self.directory)
+
+    @property
+    def matrix(self):
+        """ Read-only memory map of the spectra, one row per sample """
+        if self._matrix is None:
+            if len(self) == 0:
+                return np.empty((0, len(self.freq)), dtype=self.dtype)
+            self._matrix = np.memmap(self._path('spectra.dat'),
+                                     dtype=self.dtype, mode='r',
+                                     shape=(len(self), len(self.freq)))
+        return self._matrix
+
+    def append(self, values, names, metadata=None):
+        """ Appends spectra to the archive
+
+        Parameters
+        ----------
+        values : 1-D or 2-D array
+            Spectrum, or 2-D array with one spectrum per column, measured at
+            the archive frequencies
+
+        names : Str or list
+            Sample name(s), one per spectrum
+
+        metadata : Dict or list of dicts (optional)
+            Json serializable metadata for each spectrum, e.g. a `date`
+        """
+        values = np.asarray(values, dtype=self.dtype)
+        if values.ndim == 1:
+            values = values[:, None]
+        if isinstance(names, str):
+            names = [names]
+        if isinstance(metadata, dict):
+            metadata = [metadata]
+        names = list(names)
+        if metadata is None:
+            metadata = [dict() for _ in names]
+        if values.shape[0] != len(self.freq):
+            raise ValueError('Spectra must have {0} points, got {1}'
+                             ''.format(len(self.freq), values.shape[0]))
+        if not values.shape[1] == len(names) == len(metadata):
+            raise ValueError('Expected one name and metadata entry per '
+                             'spectrum')
+
+        # Truncate any rows left over from an interrupted append
+        offset = len(self) * len(self.freq) * self.dtype.itemsize
+        with open(self._path('spectra.dat'), 'r+b') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(np.ascontiguousarray(values.T).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        lines = list()
+        for name, meta in zip(names, metadata):
+            record = dict(meta)
+            record['name'] = name
+            lines.append(json.dumps(record, default=str) + '\n')
+        with open(self._path('index.jsonl'), 'r+b') as f:
+            # Drop a partial line left over from an interrupted append
+            f.truncate(self._index_size)
+            f.seek(self._index_size)
+            f.write(''.join(lines).encode())
+        self.refresh()
+
+    def append_dataframe(self, df, metadata=None):
+        """ Appends the spectra of a DataFrame with the frequency data in the
+        first column. The frequencies must match the archive frequencies.
+        """
+        freq = df.iloc[:, 0].to_numpy(dtype=float)
+        if not np.array_equal(freq, self.freq):
+            raise ValueError('Frequency ranges do not match the archive '
+                             'frequencies')
+        names = list(df.columns[1:])
+        self.append(df[names].to_numpy(dtype=float), names, metadata)
+
+    def positions(self, names=None, start=None, end=None, date='date',
+                  **criteria):
+        """ Returns the archive positions of the matching samples
+
+        Parameters
+        ----------
+        names : list (optional)
+            Sample names to select, in the requested order
+
+        start, end : date-like (optional)
+            Inclusive range of the `date` metadata field
+
+        date : Str (default: 'date')
+            Metadata field holding the sample date
+
+        criteria : optional
+            Metadata fields and the value (or list of values) to match
+        """
+        index = self.index
+        mask = np.ones(len(index), dtype=bool)
+        if start is not None or end is not None:
+            dates = pd.to_datetime(index[date])
+            if start is not None:
+                mask &= (dates >= pd.Timestamp(start)).to_numpy()
+            if end is not None:
+                mask &= (dates <= pd.Timestamp(end)).to_numpy()
+        for field, value in criteria.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= index[field].isin(values).to_numpy()
+        positions = np.flatnonzero(mask)
+
+        if names is not None:
+            lookup = pd.Series(np.arange(len(index)), index=index['name'])
+            missing = [name for name in names if name not in lookup.index]
+            if missing:
+                raise KeyError('Samples not in archive: {0}'.format(missing))
+            requested = lookup.loc[list(names)].to_numpy()
+            positions = requested[np.isin(requested, positions)]
+        return positions
+
+    def select(self, names=None, start=None, end=None, date='date',
+               **criteria):
+        """ Returns the matching samples as a `SpectraSet`
+
+        Takes the same arguments as `positions`. The spectra are read lazily
+        from the memory map: evenly spaced selections (e.g. all samples, or a
+        block of consecutive appends) are views of the map, other selections
+        only read the selected rows.
+        """
+        positions = self.positions(names, start, end, date, **criteria)
+        rows = _as_slice(positions)
+        if rows is None:
+            rows = positions
+        metadata = self.index.iloc[positions].set_index('name')
+        metadata.index.name = 'sample'
+        return SpectraSet(self.freq, self.matrix[rows].T,
+                          names=metadata.index.tolist(), metadata=metadata)
+
+    def spectra(self):
+        """ Returns every sample of the archive as a `SpectraSet` """
+        return self.select()
@@ -0,0 +1,165 @@
+""" On-disk cache of parsed spectra keyed by file content
+
+Parsing xlsx and csv exports (especially through openpyxl) is slow, and
+notebook cells re-run the parsing every time. `SpectraCache` stores the parsed
+DataFrame as a `.npy` matrix, which is memory-mapped on reload, next to a
+small json file holding the column names and any extra loader output. Entries
+are keyed by a hash of the file content and the loader options, and the least
+recently used entries are evicted once the cache grows beyond `max_bytes`.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+# Bump when the stored layout or the loaders' parsing changes
+CACHE_VERSION = 1
+
+MAX_BYTES = 1024**3
+
+
+def _file_digest(path, chunk_size=1 << 20):
+    """ Returns the sha256 hash of a file's content """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SpectraCache(object):
+    """ Size-bounded LRU cache of parsed spectra on disk
+
+    Parameters
+    ----------
+    directory : Str
+        Folder holding the cache entries. Created if it does not exist.
+
+    max_bytes : Int (default: 1 GiB)
+        Maximum total size of the cache entries. The least recently used
+        entries are removed when a new entry makes the cache exceed it.
+    """
+
+    def __init__(self, directory, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, path, loader, **options):
+        """ Returns the cache key for a data file and its loader options """
+        description = json.dumps(
+            {'version': CACHE_VERSION, 'loader': loader, 'options': options},
+            sort_keys=True, default=str)
+        digest = hashlib.sha256(_file_digest(path).encode())
+        digest.update(description.encode())
+        return digest.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.npy', base + '.json'
+
+    def get(self, key):
+        """ Returns the cached `(DataFrame, extra)` for a key, or `None`
+
+        The DataFrame is backed by a copy-on-write memory map of the cached
+        matrix, so nothing is read until the data is used, and changes are
+        never written back to the cache.
+        """
+        npy_path, json_path = self._paths(key)
+        try:
+            with open(json_path) as f:
+                info = json.load(f)
+            values = np.load(npy_path, mmap_mode='c')
+        except (OSError, ValueError):
+            return None
+        os.utime(json_path)
+        df = pd.DataFrame(values, columns=info['columns'], copy=False)
+        # Restore non float columns, e.g. integer frequencies
+        for column, dtype in zip(info['columns'], info['dtypes']):
+            if dtype != 'float64':
+                df[column] = df[column].astype(dtype)
+        return df, info['extra']
+
+    def put(self, key, df, extra=None):
+        """ Stores a DataFrame of numeric columns and json serializable extra
+        loader output under a key. Returns `False`, without writing anything,
+        if the DataFrame cannot be stored as a float matrix or its column
+        names and the extra output cannot be stored as json.
+        """
+        info = {'columns': df.columns.tolist(),
+                'dtypes': [str(dtype) for dtype in df.dtypes], 'extra': extra}
+        try:
+            values = df.to_numpy(dtype=float)
+            encoded = json.dumps(info).encode()
+        except (TypeError, ValueError):
+            return False
+        npy_path, json_path = self._paths(key)
+        self._write(npy_path, lambda f: np.save(f, values))
+        try:
+            self._write(json_path, lambda f: f.write(encoded))
+        except Exception:
+            # Do not leave a data file without its entry behind
+            os.remove(npy_path)
+            raise
+        self.evict()
+        return True
+
+    def _write(self, path, writer):
+        """ Atomically writes a file through a temporary file """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                writer(f)
+            os.replace(tmp, path)
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def entries(self):
+        """ Returns `(last_used, size, key)` for every cache entry """
+        entries = list()
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            npy_path, json_path = self._paths(key)
+            try:
+                size = os.path.getsize(npy_path) + os.path.getsize(json_path)
+                last_used = os.path.getmtime(json_path)
+            except OSError:
+                continue
+            entries.append((last_used, size, key))
+        return entries
+
+    def evict(self):
+        """ Removes least recently used entries until within `max_bytes` """
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            self.invalidate(key)
+            total -= size
+
+    def invalidate(self, key):
+        """ Removes a cache entry """
+        for path in self._paths(key):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def clear(self):
+        """ Removes every cache entry """
+        for _, _, key in self.entries():
+            self.invalidate(key)
+
+
+def get_cache(cache):
+    """ Returns a `SpectraCache` for a cache instance, directory or `None` """
+    if cache is None or isinstance(cache, SpectraCache):
+        return cache
+    return SpectraCache(cache)
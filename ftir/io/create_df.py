@@ -2,18 +2,41 @@ import pandas as pd
 import sys, os, math, warnings, glob, shutil
 from pathlib import Path
 
-def excel_df(filetype, data_path, file_name, max_pk_normalize=True, file_delete=False):
+from ftir.io.cache import get_cache
+
+
+def excel_df(filetype, data_path, file_name, max_pk_normalize=True, file_delete=False, cache=None):
+    """ Reads an excel or csv file of spectra into a DataFrame
+
+    `cache` can be a `ftir.io.cache.SpectraCache` or a cache directory. If
+    given, the parsed DataFrame is stored keyed by the file content and the
+    loader options, and later calls on the same file return a memory-mapped
+    copy of it instead of parsing the file again.
+    """
     datafile = data_path+'/'+file_name
     empty_meta = {1: {"Message": "No metadata for xlsx files!", 'sequence_line_or_injection':"none", 'sample':'none', 'operator':'none', 'date':'none', 'method':'none', 'detector':'none'}}
-    if filetype == 'excel':
-        df = pd.read_excel(datafile, header=0)
-    else: df = pd.read_csv(datafile, header=0)
+    cache = get_cache(cache)
+    cached = None
+    if cache is not None:
+        key = cache.key(datafile, 'excel_df', filetype=filetype,
+                        max_pk_normalize=max_pk_normalize)
+        cached = cache.get(key)
+
+    if cached is not None:
+        df, filenames = cached
+    else:
+        if filetype == 'excel':
+            df = pd.read_excel(datafile, header=0)
+        else: df = pd.read_csv(datafile, header=0)
+
+        filenames = df.columns.to_list()[1:]
+        for name in filenames:
+            if max_pk_normalize: 
+                df[name] = df[name]/df[name].max()
+            else:
+                df[name] = df[name]
+        if cache is not None:
+            cache.put(key, df, filenames)
 
     if file_delete: os.remove(datafile)
-    filenames = df.columns.to_list()[1:]
-    for name in filenames:
-        if max_pk_normalize: 
-            df[name] = df[name]/df[name].max()
-        else:
-            df[name] = df[name]
     return df, filenames, empty_meta
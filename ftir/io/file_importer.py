@@ -1,12 +1,12 @@
 import tempfile
 import zipfile as zf
-import ipywidgets as widgets
 import os
 from ftir.io.create_df import excel_df
 
 # make class for file_upload to allow separate instances of file handling (may not be necessary)
 class file_select(): 
     def __init__(self):
+        import ipywidgets as widgets
         self.files = widgets.FileUpload(
             accept= '.csv, .xlsx, xls', 
             multiple=False 
@@ -1,15 +1,8 @@
 '''from: https://gist.github.com/pbugnion/5bb7878ff212a0116f0f1fbc9f431a5c and https://stackoverflow.com/questions/57219796/ipywidgets-dynamic-creation-of-checkboxes-and-selection-of-data'''
-import difflib
-import random
-import requests
-import ipywidgets as widgets
-
-from ftir.io.plotly_plots import raw_data_graph
-
-import ipywidgets as widgets
 import itertools
 
 def multi_checkbox_widget(sample_names):
+    import ipywidgets as widgets
     flatten = itertools.chain.from_iterable #tool to flatten a nested list
     names = []
     checkbox_objects = []
@@ -32,6 +25,7 @@ def multi_checkbox_widget(sample_names):
     return(selected_data)
 
 def selected_files_df(selection, df):
+    from ftir.io.plotly_plots import raw_data_graph
     selection.insert(0, df.columns[0])
     raw_data_graph(df[selection])
     return df[selection].copy()
@@ -40,7 +34,6 @@ def selected_files_df(selection, df):
 
 def multi_checkbox_grapher(sample_names, df):
     import ipywidgets as widgets
-    import itertools
     from ftir.io.plotly_plots import raw_data_graph
     output = widgets.Output()
     plot_output = widgets.Output()
@@ -1,16 +1,38 @@
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
 import pandas as pd
 
+from ftir.io.cache import get_cache
+
+
+SINGLE_FILE_MIN_FREQ = 999
+SINGLE_FILE_MAX_FREQ = 3999
 
-def create_df_from_single_file(data_filename, folder_path):
+
+def create_df_from_single_file(data_filename, folder_path, cache=None):
     """ Creates a DataFrame with protein formulations for the given input data
     files
+
+    `cache` can be a `ftir.io.cache.SpectraCache` or a cache directory. If
+    given, the parsed DataFrame is stored keyed by the file content, and later
+    calls on the same file return a memory-mapped copy of it.
     """
+    data_path = folder_path + '/' + data_filename
+    cache = get_cache(cache)
+    if cache is not None:
+        key = cache.key(data_path, 'create_df_from_single_file',
+                        min_freq=SINGLE_FILE_MIN_FREQ,
+                        max_freq=SINGLE_FILE_MAX_FREQ)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
 
-    df = pd.read_csv(folder_path + '/' + data_filename)
+    df = pd.read_csv(data_path)
 
-    df2 = df.columns.get_values()
-    filename_list = df2.tolist()
+    filename_list = df.columns.tolist()
     file_names = ['freq']
     for f in filename_list[1:]:
         title = f.split('.')[0]
@@ -24,40 +46,97 @@ def create_df_from_single_file(data_filename, folder_path):
 
     # Ensures the dataframe is truncated to maximum 1000 - 3999 wavenumber
     # range to start
-    df = df[(df[df.columns[0]] < 3999) & (df[df.columns[0]] > 999)]
+    df = df[(df[df.columns[0]] < SINGLE_FILE_MAX_FREQ) &
+            (df[df.columns[0]] > SINGLE_FILE_MIN_FREQ)]
     df.reset_index(drop=True, inplace=True)
 
+    if cache is not None:
+        cache.put(key, df, file_names)
     return df, file_names
 
 
+def _read_spectrum_file(filename):
+    """ Returns the frequency and absorbance arrays of a two column file """
+    data = pd.read_csv(filename, header=None).to_numpy(dtype=float)
+    if data.ndim != 2 or data.shape[1] != 2:
+        raise ValueError('Expected two columns (frequency and absorbance) in '
+                         'data file: {0}'.format(filename))
+    return data[:, 0], data[:, 1]
+
+
+def _hash_array(values):
+    """ Returns a hash of the raw bytes of an array """
+    return hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest()
+
+
 def create_df_from_multiple_files(
-        data_filenames, max_freq=3999, min_freq=1000):
+        data_filenames, max_freq=3999, min_freq=1000, workers=None,
+        progress=None):
     """Creates a DataFrame with protein formulations for the given input data
     files
 
+    The files are parsed in parallel on a thread pool, every frequency axis is
+    checked against the buffer by hash, and each absorbance column is written
+    into a preallocated matrix, so the DataFrame is only built once.
+
     data_file_names : Iterable
         Iterable of file path strings. Must be ordered such that the buffer
         file path is first. All frequency data must be the same to be analyzed
         together. The frequency data of the buffer file is taken and, and all
         other frequency values are checked against the buffer frequency.
+
+    max_freq : Number (default: 3999)
+        Maximum frequency kept in the returned DataFrame
+
+    min_freq : Number (default: 1000)
+        Minimum frequency kept in the returned DataFrame
+
+    workers : Int (default: None)
+        Number of threads used to parse the files. Defaults to the
+        `ThreadPoolExecutor` default.
+
+    progress : Callable (default: None)
+        Called as `progress(done, total, filename)` each time a file has been
+        loaded, e.g. to report progress on directories with thousands of
+        files.
     """
-    df = pd.read_csv(data_filenames[0], header=None)
-    df.columns = ['freq', 'buffer']
+    data_filenames = list(data_filenames)
+    total = len(data_filenames)
+    freq, buffer = _read_spectrum_file(data_filenames[0])
+    freq_hash = _hash_array(freq)
+    if progress is not None:
+        progress(1, total, data_filenames[0])
+
+    values = np.empty((len(freq), total))
+    values[:, 0] = buffer
     file_names = ['freq', 'buffer']
-    for f in data_filenames[1:]:
-        d = pd.read_csv(f, header=None)
-        title = os.path.basename(f).split('.')[0]
-        d.columns = ['freq', title]
-        if not df['freq'].equals(d['freq']):
-            raise ValueError(
-                'Frequency ranges do not match. Sample data file: {0}\n'
-                'Buffer data file: {1}'.format(f, data_filenames[0]))
-        df = pd.concat([df, d[title]], axis=1)
-        file_names.append(title)
+    file_names.extend(os.path.basename(f).split('.')[0]
+                      for f in data_filenames[1:])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_read_spectrum_file, f): i
+                   for i, f in enumerate(data_filenames[1:], 1)}
+        try:
+            for done, future in enumerate(as_completed(futures), 2):
+                i = futures[future]
+                f_freq, absorbance = future.result()
+                if len(f_freq) != len(freq) or _hash_array(f_freq) != freq_hash:
+                    raise ValueError(
+                        'Frequency ranges do not match. Sample data file: '
+                        '{0}\nBuffer data file: {1}'.format(
+                            data_filenames[i], data_filenames[0]))
+                values[:, i] = absorbance
+                if progress is not None:
+                    progress(done, total, data_filenames[i])
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
 
     # Ensures the dataframe is sorted descending wavenumber
-    df = df.sort_values(by=['freq'], ascending=False)
-    df = df[(df['freq'] <= max_freq) & (df['freq'] >= min_freq)]
-    df.reset_index(drop=True, inplace=True)
+    order = np.argsort(-freq, kind='stable')
+    order = order[(freq[order] <= max_freq) & (freq[order] >= min_freq)]
+    df = pd.DataFrame(values[order], columns=file_names[1:])
+    df.insert(0, 'freq', freq[order])
 
     return df, file_names
@@ -1,11 +1,66 @@
-def area_norm(df):
-    """Normalize to area of 1"""
+from ftir.modeling.instrumentation import instrumented
+from ftir.spectra import accepts_spectra
+
+
+def _integrator(method):
+    """ Returns the scipy integration function of a method name """
     from scipy import integrate
+    # `simps` and `trapz` were renamed in SciPy 1.6 and removed later on
+    if method == 'simpson':
+        return getattr(integrate, 'simpson', None) or integrate.simps
+    if method == 'trapezoid':
+        return getattr(integrate, 'trapezoid', None) or integrate.trapz
+    raise NameError('name {0} is not a supported integration method. Use '
+                    'simpson or trapezoid'.format(method))
+
+
+@instrumented
+@accepts_spectra
+def area_norm(df, min_freq=None, max_freq=None, method='simpson'):
+    """Normalize to area of 1
+
+    The areas of all the spectra are integrated in one call over the spectra
+    matrix, and the input frame is left unchanged. The absolute area is used
+    because decreasing frequency values give negative areas.
+
+    Parameters
+    ----------
+    df : DataFrame
+        pandas dataframe containing the FTIR data. The first column must be
+        the wavenumber data, and the remaining columns the spectral data.
+
+    min_freq, max_freq : Number (optional)
+        Only integrate the area between these frequencies. The whole spectra
+        are still normalized. Defaults to the whole frequency range.
+
+    method : Str (default: 'simpson')
+        Integration rule, `simpson` or `trapezoid`
+
+    Returns
+    -------
+    DataFrame
+        New dataframe with the frequency column and the normalized spectra
+    """
+    import numpy as np
     import pandas as pd
-    pd.options.mode.chained_assignment = None  # default='warn'
-    proteins = list(df.columns)[1:]
 
-    for i in proteins:
-        dy = integrate.simps(df.loc[:,i], df.iloc[:,0]) 
-        df.loc[:,i] = df.loc[:,i]/abs(dy) #absolute value because decreasing x-values give negative area
-    return df.copy()
+    integrate = _integrator(method)
+    freq = df.iloc[:, 0].to_numpy(dtype=float)
+    values = df.iloc[:, 1:].to_numpy(dtype=float)
+
+    x, y = freq, values
+    if min_freq is not None or max_freq is not None:
+        low = -np.inf if min_freq is None else min_freq
+        high = np.inf if max_freq is None else max_freq
+        inside = (freq >= low) & (freq <= high)
+        if inside.sum() < 2:
+            raise ValueError('At least two frequencies are required between '
+                             '{0} and {1} to integrate the area'
+                             ''.format(min_freq, max_freq))
+        x, y = freq[inside], values[inside]
+    area = np.abs(integrate(y, x=x, axis=0))
+
+    result = pd.DataFrame(values / area, index=df.index,
+                          columns=df.columns[1:], copy=False)
+    result.insert(0, df.columns[0], df.iloc[:, 0])
+    return result
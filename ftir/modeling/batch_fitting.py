@@ -0,0 +1,472 @@
+"""
+Batch peak fitting across all sample columns of a dataframe
+
+The Gaussian fitters in `ftir.modeling.peak_fitting` fit a single column at a
+time. `fit_all` spreads the sample columns of a dataframe across a process
+pool. Each worker only receives the frequency axis and its own absorbance
+column as arrays, and the results of every fit are collected into one
+dataframe with the peak areas, a summary of the optimization result, and the
+secondary structure content. `fit_series` warm starts the fits of an ordered
+series of spectra, and `fit_global` fits all the spectra together with shared
+peak centers.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import optimize
+
+from ftir.modeling.peak_definitions import yang_h20_2015
+from ftir.modeling.peak_fitting import (
+    _solve_heights, gaussian_integral, gaussian_least_squares,
+    gaussian_minimize, gaussian_differential_evolution, gaussian_multistart,
+    gaussian_sum, gaussian_variable_projection, guess_heights,
+    secondary_structure)
+from ftir.modeling.fit_cache import fit_key
+from ftir.modeling.instrumentation import instrumented
+from ftir.spectra import SpectraSet
+
+
+FIT_METHODS = {
+    'least_squares': gaussian_least_squares,
+    'minimize': gaussian_minimize,
+    'differential_evolution': gaussian_differential_evolution,
+    'variable_projection': gaussian_variable_projection,
+    'multistart': gaussian_multistart,
+}
+
+FREQ = 'freq'
+
+
+def _get_fit_method(method):
+    """ Returns the fitting function for a method name or callable """
+    if callable(method):
+        return method
+    try:
+        return FIT_METHODS[method]
+    except KeyError:
+        raise NameError('name {0} is not a supported fitting method. Use one '
+                        'of: {1}'.format(method, ', '.join(FIT_METHODS)))
+
+
+def _summarize_result(res):
+    """ Returns a picklable summary of a scipy optimization result
+
+    The `cost` is the residual sum of squares for every method:
+    `optimize.least_squares` reports half of it as `cost`, while the
+    `minimize` and differential evolution fits report it as `fun`.
+    """
+    cost = 2 * res.cost if 'cost' in res else res.fun
+    return {
+        'success': bool(res.success),
+        'message': str(res.message),
+        'cost': float(cost),
+        'nfev': int(res.get('nfev', -1)),
+        'nit': int(res.get('nit', -1)),
+        'x': np.asarray(res.x),
+    }
+
+
+def _fit_column(method, x, y, col, peaks, peak_width, params, x0=None):
+    """ Fits a single spectrum given as frequency and absorbance arrays
+
+    Worker function for `fit_all` and `gaussian_multistart`. A two column
+    dataframe is rebuilt from the arrays so the existing fitting functions
+    can be used unchanged, and only the arrays are sent to the workers.
+    """
+    fit = _get_fit_method(method)
+    df = pd.DataFrame({FREQ: x})
+    df[col] = y
+    kwargs = {'peaks': peaks, 'peak_width': peak_width}
+    if params is not None:
+        kwargs['params'] = dict(params)
+    if x0 is not None:
+        kwargs['x0'] = x0
+    areas, res = fit(df, col, **kwargs)
+    return [float(a) for a in areas], res
+
+
+def _start_cost(frame, col, heights, centers, peak_width):
+    """ Returns the sum of squared residuals of the Gaussian model with the
+    given peak heights and centers, and the maximum peak width
+    """
+    p = np.column_stack([heights, centers,
+                         np.full(len(centers), float(peak_width))]).ravel()
+    residuals = (gaussian_sum(frame.iloc[:, 0].to_numpy(), *p)
+                 - frame[col].to_numpy())
+    return float(residuals @ residuals)
+
+
+def _fit_task(task):
+    """ Unpacks a `fit_all` task tuple for `Executor.map` """
+    return _fit_column(*task)
+
+
+@instrumented
+def fit_all(df, method='least_squares', peaks=yang_h20_2015, peak_width=5,
+            params=None, cols=None, workers=None, chunksize=1, cache=None):
+    """ Fits every sample column of a dataframe using a process pool
+
+    Parameters
+    ----------
+    df : DataFrame or SpectraSet
+        pandas dataframe containing the FTIR data. The first column must be
+        the wavenumber data, and the remaining columns the spectral data.
+
+    method : Str or Callable (default: 'least_squares')
+        Fitting method. Can be `least_squares`, `minimize`,
+        `differential_evolution`, `variable_projection` or `multistart`, or
+        a picklable callable with the same signature as
+        `gaussian_least_squares`.
+
+    peaks : Peak Definitions (optional)
+        A dictionary containing peak definitions to be used. Defaults to the
+        Yang et. al, Nature Protocol 2015. peak definitions.
+
+    peak_width : Int (optional)
+        Maximum peak width. Defaults to 5
+
+    params : Dict (optional)
+        A dictionary of kwargs passed to the scipy optimization algorithm of
+        the fitting method. If `None`, the fitting method defaults are used.
+
+    cols : list (default: None)
+        List of column names to fit. Defaults to every column except the
+        frequency column.
+
+    workers : Int (default: None)
+        Number of worker processes. Defaults to the number of CPUs. If `1`,
+        the fits are run serially in the current process.
+
+    chunksize : Int (default: 1)
+        Number of columns sent to a worker at a time. Larger values reduce
+        the inter-process overhead when fitting many fast spectra.
+
+    cache : FitCache (default: None)
+        Cache of fit results. Samples whose spectrum, frequency axis, peak
+        definitions, peak width, method and parameters match a cached fit
+        are not re-fit, and new fits are added to the cache.
+
+    Returns
+    -------
+    DataFrame
+        One row per sample containing the secondary structure content, the
+        area of each peak (`area_<mean>`), and the optimization summary
+        (`success`, `message`, `cost`, `nfev`, `nit` and the fitted
+        parameters `x`). The `cost` is the residual sum of squares, so it can
+        be compared across fitting methods.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    _get_fit_method(method)
+
+    if isinstance(df, SpectraSet):
+        x = df.freq
+        spectra = df
+    else:
+        x = df.iloc[:, 0].to_numpy(dtype=float)
+        spectra = SpectraSet.from_dataframe(df)
+    if cols is None:
+        cols = list(spectra.names)
+    fits = dict()
+    keys = dict()
+    if cache is not None:
+        fit = _get_fit_method(method)
+        for col in cols:
+            keys[col] = fit_key(x, spectra[col], peaks, peak_width, fit,
+                                params)
+            cached = cache.get(keys[col])
+            if cached is not None:
+                fits[col] = cached
+
+    tasks = [(method, x, spectra[col], col, peaks, peak_width, params)
+             for col in cols if col not in fits]
+    if workers == 1 or len(tasks) <= 1:
+        results = [_fit_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as ex:
+            results = list(ex.map(_fit_task, tasks, chunksize=chunksize))
+    for task, result in zip(tasks, results):
+        col = task[3]
+        fits[col] = result
+        if cache is not None:
+            cache.put(keys[col], result)
+
+    area_names = ['area_{0}'.format(mean) for mean in peaks['means']]
+    rows = list()
+    for col in cols:
+        areas, res = fits[col]
+        row = secondary_structure(areas, peaks)
+        row.update(zip(area_names, areas))
+        row.update(_summarize_result(res))
+        rows.append(row)
+    return pd.DataFrame(rows, index=pd.Index(cols, name='sample'))
+
+
+@instrumented
+def fit_series(df, method='least_squares', peaks=yang_h20_2015, peak_width=5,
+               params=None, cols=None, start='previous'):
+    """ Fits an ordered series of spectra, warm starting each fit
+
+    In time-course and stability series, neighbouring spectra differ only a
+    little, and the peak centers of an already fit spectrum are a better
+    start than the peak means. Only the centers are warm started: the
+    heights are re-guessed from the current spectrum and the widths start
+    from the default, since carrying over the previous heights and widths
+    traps the fit in the local minimum of the previous spectrum.
+
+    The warm start is only used if the Gaussian model with the previous
+    centers (and the guessed heights and maximum peak width) fits the
+    current spectrum better than with the peak means. Otherwise, or if the
+    warm started fit does not converge, the spectrum is fit from the
+    default (cold) start.
+
+    Parameters
+    ----------
+    df : DataFrame or SpectraSet
+        pandas dataframe containing the FTIR data. The first column must be
+        the wavenumber data, and the remaining columns the spectral data.
+
+    method : Str or Callable (default: 'least_squares')
+        Fitting method. Can be `least_squares`, `minimize` or
+        `variable_projection`, or a callable with the same signature as
+        `gaussian_least_squares`, including its `x0` keyword. The heights
+        and widths of `x0` are NaN, to be replaced by the default start.
+
+    peaks : Peak Definitions (optional)
+        A dictionary containing peak definitions to be used. Defaults to the
+        Yang et. al, Nature Protocol 2015. peak definitions.
+
+    peak_width : Int (optional)
+        Maximum peak width. Defaults to 5
+
+    params : Dict (optional)
+        A dictionary of kwargs passed to the scipy optimization algorithm of
+        the fitting method. If `None`, the fitting method defaults are used.
+
+    cols : list (default: None)
+        Ordered list of column names to fit. Defaults to every column except
+        the frequency column, in order.
+
+    start : Str (default: 'previous')
+        Which fit to warm start from. `previous` uses the previous spectrum
+        in the series. `nearest` uses the already fit spectrum closest to the
+        current one (euclidean distance between the spectra).
+
+    Returns
+    -------
+    DataFrame
+        The same results table as `fit_all`, with two more columns:
+        `start_from`, the sample whose centers were tried as the start
+        (`None` for the first spectrum), and `warm_start`, whether the warm
+        started fit was kept.
+    """
+    warm_methods = ('least_squares', 'minimize', 'variable_projection')
+    if method not in warm_methods and not callable(method):
+        raise NameError('name {0} is not a supported warm start fitting '
+                        'method. Use one of: {1}'.format(
+                            method, ', '.join(warm_methods)))
+    fit = _get_fit_method(method)
+    if start not in ('previous', 'nearest'):
+        raise NameError('name {0} is not a supported start. Use previous or '
+                        'nearest'.format(start))
+
+    if not isinstance(df, SpectraSet):
+        df = SpectraSet.from_dataframe(df)
+    if cols is None:
+        cols = list(df.names)
+    kwargs = {'peaks': peaks, 'peak_width': peak_width}
+
+    def run(col, x0=None):
+        if params is not None:
+            kwargs['params'] = dict(params)
+        return fit(frame, col, x0=x0, **kwargs)
+
+    area_names = ['area_{0}'.format(mean) for mean in peaks['means']]
+    n = len(peaks['means'])
+    fitted = list()
+    rows = list()
+    for col in cols:
+        frame = pd.DataFrame({FREQ: df.freq})
+        frame[col] = df[col]
+        source = None
+        if fitted and start == 'previous':
+            source = fitted[-1]
+        elif fitted:
+            spectra = np.column_stack([df[name] for name, _ in fitted])
+            distance = ((spectra - df[col][:, None])**2).sum(axis=0)
+            source = fitted[int(distance.argmin())]
+
+        warm = False
+        if source is not None:
+            centers = np.asarray(source[1].x, dtype=float).reshape(-1, 3)[:, 1]
+            heights = guess_heights(frame, col, peaks['means'])
+            warm = (_start_cost(frame, col, heights, centers, peak_width)
+                    < _start_cost(frame, col, heights, peaks['means'],
+                                  peak_width))
+        if warm:
+            x0 = np.full(3*n, np.nan)
+            x0[1::3] = centers
+            areas, res = run(col, x0=x0)
+            warm = bool(res.success)
+        if not warm:
+            areas, res = run(col)
+        fitted.append((col, res))
+
+        row = secondary_structure(areas, peaks)
+        row.update(zip(area_names, areas))
+        row.update(_summarize_result(res))
+        row['start_from'] = source[0] if source is not None else None
+        row['warm_start'] = warm
+        rows.append(row)
+    return pd.DataFrame(rows, index=pd.Index(cols, name='sample'))
+
+
+@instrumented
+def fit_global(df, peaks=yang_h20_2015, peak_width=5, params=None, cols=None,
+               share_widths=True):
+    """ Fits several spectra together with shared peak centers
+
+    When all samples are the same protein, e.g. in a formulation screen, the
+    peak positions should not change from sample to sample. Fitting every
+    column on its own lets the centers drift, which adds noise to the
+    secondary structure comparison. Here the peak centers, and by default
+    the widths, are shared by all the spectra and only the heights are fit
+    per spectrum, in one `optimize.least_squares` problem over the stacked
+    residuals of every spectrum.
+
+    As in `gaussian_variable_projection`, the heights of each spectrum are
+    solved by bounded non-negative least squares for every trial set of
+    centers and widths, so the search only runs over the shared parameters.
+    The heights are bounded by the largest absolute absorbance of their
+    spectrum and the widths below by a tenth of the maximum peak width, so
+    no peak collapses into a tall spike. With
+    `share_widths=False` the Jacobian is block sparse, as the widths of a
+    spectrum only change the residuals of that spectrum.
+
+    Parameters
+    ----------
+    df : DataFrame or SpectraSet
+        pandas dataframe containing the FTIR data. The first column must be
+        the wavenumber data, and the remaining columns the spectral data.
+
+    peaks : Peak Definitions (optional)
+        A dictionary containing peak definitions to be used. Defaults to the
+        Yang et. al, Nature Protocol 2015. peak definitions.
+
+    peak_width : Int (optional)
+        Maximum peak width. Defaults to 5
+
+    params : Dict (optional)
+        A dictionary of kwargs passed to `optimize.least_squares`.
+
+    cols : list (default: None)
+        List of column names to fit. Defaults to every column except the
+        frequency column.
+
+    share_widths : bool (default: True)
+        Share the peak widths across the spectra as well as the centers. If
+        False, the widths are fit per spectrum, which is a much larger
+        problem and is usually slower than fitting the spectra separately.
+
+    Returns
+    -------
+    DataFrame
+        The same results table as `fit_all`. The `cost` is the residual sum
+        of squares of each spectrum, `success`, `message`, `nfev` and `nit` are those of the
+        joint fit, and the parameters `x` of every sample hold the shared
+        centers.
+    """
+    if not isinstance(df, SpectraSet):
+        df = SpectraSet.from_dataframe(df)
+    if cols is not None:
+        df = df.select(cols)
+    cols = list(df.names)
+    x = df.freq
+    y = np.asarray(df.values, dtype=float).T
+    n_samples, n_points = y.shape
+    n = len(peaks['means'])
+    n_widths = 1 if share_widths else n_samples
+    upper = np.repeat(np.abs(y).max(axis=1)[:, None], n, axis=1)
+
+    bounds = np.asarray(peaks['uncertainties'], dtype=float)
+    lb = np.concatenate([bounds[:, 0], np.full(n_widths*n, peak_width/10)])
+    ub = np.concatenate([bounds[:, 1],
+                         np.full(n_widths*n, float(peak_width))])
+    guess = np.concatenate([peaks['means'], np.full(n_widths*n, peak_width/2)])
+
+    # Column of every Jacobian entry if the widths are fit per spectrum: the
+    # shared centers, then the widths of the spectrum of the row
+    width_cols = n + np.arange(n_samples*n).reshape(n_samples, 1, n)
+    sparse_cols = np.concatenate(
+        [np.broadcast_to(np.arange(n), (n_samples, n_points, n)),
+         np.broadcast_to(width_cols, (n_samples, n_points, n))],
+        axis=2).ravel()
+    sparse_rows = np.arange(0, n_samples*n_points*2*n + 1, 2*n)
+
+    last = {}
+
+    def project(q):
+        """ Returns the heights, residuals and unprojected derivatives for
+        centers and widths `q`
+        """
+        if last.get('q') is not None and np.array_equal(last['q'], q):
+            return last['heights'], last['residuals'], last['derivatives']
+        centers = q[:n]
+        widths = np.broadcast_to(q[n:].reshape(n_widths, 1, n),
+                                 (n_samples, 1, n))
+        diff = x[:, None] - centers
+        scaled = diff / widths**2
+        unit = np.exp(-diff * scaled / 2)
+        heights = np.array([_solve_heights(unit[i], y[i], upper[i])
+                            for i in range(n_samples)])
+        residuals = np.einsum('spn,sn->sp', unit, heights) - y
+        d_center = unit * scaled * heights[:, None, :]
+        derivatives = np.concatenate([d_center, d_center * diff / widths],
+                                     axis=2)
+        # Project out the span of the (unit height) peaks of each spectrum
+        # whose heights are not at a bound
+        for i in range(n_samples):
+            free = (heights[i] > 0) & (heights[i] < upper[i])
+            if free.any():
+                basis, _ = np.linalg.qr(unit[i][:, free])
+                derivatives[i] -= basis @ (basis.T @ derivatives[i])
+        last.update(q=q.copy(), heights=heights, residuals=residuals,
+                    derivatives=derivatives)
+        return heights, residuals, derivatives
+
+    def fun(q):
+        return project(q)[1].ravel()
+
+    def jac(q):
+        derivatives = project(q)[2]
+        if share_widths:
+            # Centers and widths of all spectra are the same parameters
+            return derivatives.reshape(-1, 2*n)
+        from scipy import sparse
+        return sparse.csr_matrix(
+            (derivatives.ravel(), sparse_cols, sparse_rows),
+            shape=(n_samples*n_points, n + n_samples*n))
+
+    params = dict(params or dict())
+    params.setdefault('jac', jac)
+    params.setdefault('x_scale', 'jac')
+    params['bounds'] = (lb, ub)
+    res = optimize.least_squares(fun, guess, **params)
+
+    heights, residuals, _ = project(res.x)
+    centers = res.x[:n]
+    widths = np.broadcast_to(res.x[n:].reshape(n_widths, n), (n_samples, n))
+    area_names = ['area_{0}'.format(mean) for mean in peaks['means']]
+    rows = list()
+    for i in range(n_samples):
+        areas = [gaussian_integral(h, w)
+                 for h, w in zip(heights[i], widths[i])]
+        row = secondary_structure(areas, peaks)
+        row.update(zip(area_names, areas))
+        row.update(_summarize_result(res))
+        row['cost'] = float(residuals[i] @ residuals[i])
+        row['x'] = np.column_stack([heights[i], centers, widths[i]]).ravel()
+        rows.append(row)
+    return pd.DataFrame(rows, index=pd.Index(cols, name='sample'))
@@ -21,6 +21,9 @@ import pandas as pd
 import numpy as np
 from scipy import optimize
 
+from ftir.modeling.instrumentation import instrumented
+from ftir.spectra import accepts_spectra
+
 
 WINDOW_SIZE = 12
 WINDOW_MIN = 1710
@@ -28,6 +31,8 @@ WINDOW_MAX = 2200
 MIN_PERIODS = 1
 
 
+@instrumented
+@accepts_spectra
 def find_buffer_subtraction_constant(df, sample, buffer, **params):
     """ Returns the constant to use for the buffer signal subtraction
 
@@ -79,8 +84,118 @@ def find_buffer_subtraction_constant(df, sample, buffer, **params):
     return res.x
 
 
+def _rolling_mean(values, window, min_periods):
+    """ Centered rolling mean along the first axis of a 2-D array
+
+    Matches `pandas.Series.rolling(window, center=True).mean()`. The box
+    kernel is applied as a convolution through cumulative sums, so every
+    column is smoothed in a single pass.
+    """
+    n = values.shape[0]
+    idx = np.arange(n)
+    start = np.maximum(idx - window // 2, 0)
+    end = np.minimum(idx + window - window // 2, n)
+    counts = (end - start).astype(float)
+
+    cumulative = np.zeros((n + 1,) + values.shape[1:])
+    np.cumsum(values, axis=0, out=cumulative[1:])
+    smoothed = (cumulative[end] - cumulative[start]) / counts[:, None]
+    smoothed[counts < min_periods] = np.nan
+    return smoothed
+
+
+@instrumented
+@accepts_spectra
+def find_buffer_subtraction_constants(df, samples, buffer, **params):
+    """ Returns the buffer subtraction constants for all samples at once
+
+    Batched equivalent of `find_buffer_subtraction_constant`. The optimization
+    window is sliced once into a 2-D array and the rolling mean is applied to
+    the sample and buffer spectra up front. Because the rolling mean is
+    linear, the smoothed subtracted signal for a constant `c` is
+    `smoothed_sample - c * smoothed_buffer`, and the objective (the range of
+    that signal) is a convex, piecewise linear function of `c`. The minimum is
+    found for every sample together by bisection on the sign of its
+    subgradient.
+
+    Parameters
+    ----------
+    df : Dataframe
+        Dataframe containing both the sample and buffer spectra
+
+    samples : Iterable
+        Column names in the dataframe for the sample spectra
+
+    buffer : String
+        Column name in the dataframe for the buffer spectra
+
+    params : Optional
+        Same parameters as `find_buffer_subtraction_constant`, plus:
+            * `xtol` specifies the absolute tolerance on the returned
+            constants
+
+    Returns
+    -------
+    1-D array
+        Scaling constants ordered the same as `samples`
+    """
+    frequency_col = params.get('freq', 'freq')
+    window = params.get('rolling_window', WINDOW_SIZE)
+    window_min = params.get('window_min', WINDOW_MIN)
+    window_max = params.get('window_max', WINDOW_MAX)
+    min_periods = params.get('min_periods', MIN_PERIODS)
+    xtol = params.get('xtol', 1e-10)
+
+    samples = list(samples)
+    freq = df[frequency_col].to_numpy()
+    mask = (freq < window_max) & (freq > window_min)
+    if not mask.any():
+        raise ValueError(
+            'No frequencies found between {0} and {1} for the buffer '
+            'subtraction optimization.'.format(window_min, window_max))
+
+    values = df[samples].to_numpy(dtype=float)[mask]
+    smoothed = _rolling_mean(values, window, min_periods)
+    smoothed_buffer = _rolling_mean(
+        df[buffer].to_numpy(dtype=float)[mask][:, None], window, min_periods)
+    if min_periods > 1:
+        valid = ~np.isnan(smoothed_buffer[:, 0])
+        smoothed = smoothed[valid]
+        smoothed_buffer = smoothed_buffer[valid]
+
+    def subgradient(c):
+        """ Subgradient of the smoothed signal range for each constant """
+        sub = smoothed - c * smoothed_buffer
+        return (smoothed_buffer[sub.argmin(axis=0), 0] -
+                smoothed_buffer[sub.argmax(axis=0), 0])
+
+    # Bracket the minimum of every sample around the same starting point used
+    # by `find_buffer_subtraction_constant`
+    lower = np.full(len(samples), 0.99 - 1.0)
+    upper = np.full(len(samples), 0.99 + 1.0)
+    step = 1.0
+    while True:
+        low_side = subgradient(lower) > 0
+        high_side = subgradient(upper) < 0
+        if not (low_side.any() or high_side.any()):
+            break
+        step *= 2
+        lower[low_side] -= step
+        upper[high_side] += step
+
+    # Bisect until every bracket is within tolerance
+    while len(samples) and (upper - lower).max() > xtol:
+        middle = 0.5 * (lower + upper)
+        increasing = subgradient(middle) > 0
+        upper = np.where(increasing, middle, upper)
+        lower = np.where(increasing, lower, middle)
+    return 0.5 * (lower + upper)
+
+
+@instrumented
+@accepts_spectra
 def buffer_subtract(df, buffer=1, baseline_min=1729, baseline_max=1731,
-                    freq='freq', constant=find_buffer_subtraction_constant,
+                    freq='freq', constant=find_buffer_subtraction_constants,
                     constant_params=dict()):
     """ Returns a DataFrame of the subtracted signal data
 
@@ -109,7 +224,9 @@ def buffer_subtract(df, buffer=1, baseline_min=1729, baseline_max=1731,
 
     constant : Callable or Int (optional)
         Can be a callable that takes the dataframe, sample location and buffer
-        location and returns an integer. Can also specify an integer constant
+        location and returns an integer. Can also specify an integer constant.
+        Defaults to `find_buffer_subtraction_constants`, which solves the
+        constants for all samples in a single batched call.
 
     constant_params : Dict (optional)
         Parameters passed to the buffer subtraction `constant` function
@@ -124,24 +241,31 @@ def buffer_subtract(df, buffer=1, baseline_min=1729, baseline_max=1731,
     buffer_col = df.columns[buffer]
     samples = df.columns.drop([freq, buffer_col])
 
-    subtracted_spectra = {freq: df[freq]}
-    for sample in samples:
-        if callable(constant):
-            scaling_constant = constant(df, sample, buffer_col,
-                                        **constant_params)
-        else:
-            scaling_constant = constant
-        offset_result = df[sample] - scaling_constant * df[buffer_col]
-
-        baseline = offset_result[(df[freq] > baseline_min) &
-                                 (df[freq] < baseline_max)].mean()
-        if np.isnan(baseline):
-            raise ValueError(
-                'Could not determine a baseline value for the buffer '
-                'subtraction. Attempted to average the baseline values from '
-                '{0} to {1}.'.format(baseline_min, baseline_max))
-
-        result = offset_result - baseline
-        subtracted_spectra[sample] = result.values
-    final_subtracted = pd.DataFrame(subtracted_spectra)
+    if constant is find_buffer_subtraction_constants:
+        params = dict(constant_params)
+        params.setdefault('freq', freq)
+        scaling_constants = constant(df, samples, buffer_col, **params)
+    elif callable(constant):
+        scaling_constants = np.array(
+            [constant(df, sample, buffer_col, **constant_params)
+             for sample in samples], dtype=float).reshape(len(samples))
+    else:
+        scaling_constants = np.full(len(samples), constant, dtype=float)
+
+    offset_result = (df[samples].to_numpy(dtype=float) -
+                     scaling_constants * df[[buffer_col]].to_numpy(dtype=float))
+
+    baseline_mask = ((df[freq] > baseline_min) &
+                     (df[freq] < baseline_max)).to_numpy()
+    with np.errstate(invalid='ignore'):
+        baseline = offset_result[baseline_mask].mean(axis=0)
+    if np.isnan(baseline).any():
+        raise ValueError(
+            'Could not determine a baseline value for the buffer '
+            'subtraction. Attempted to average the baseline values from '
+            '{0} to {1}.'.format(baseline_min, baseline_max))
+
+    final_subtracted = pd.DataFrame(offset_result - baseline,
+                                    columns=samples, index=df.index)
+    final_subtracted.insert(0, freq, df[freq])
     return final_subtracted
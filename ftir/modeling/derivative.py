@@ -1,94 +1,242 @@
-from scipy.spatial import ConvexHull
+from functools import lru_cache
+
 from scipy import sparse
-from scipy.sparse.linalg import spsolve
+from scipy.linalg import LinAlgError, solve_banded, solveh_banded
 import numpy as np
 import pandas as pd
 
-def find_deriv(df, flip, window_length=5):
-    """Adds the 2nd derivative of the chosen signal to the DataFrame
-        Window_length=5 is recommended from our studies"""
-    from scipy.signal import savgol_filter
+from ftir.modeling.instrumentation import instrumented
+from ftir.spectra import accepts_spectra
 
-    proteins = list(df.columns)[1:]
-    drub_df = df[[df.columns[0]]].copy()
-    for i in proteins:
-        colname = str(i) + '_deriv'
 
-        if flip:
-            # negative if want flipped
-            dd = -1 * savgol_filter(df[i], deriv=2,
-                                    window_length=window_length, polyorder=3
-                                    )
+def _savgol_second_derivative(values, window_length, convolution='direct'):
+    """ Second derivative Savitzky-Golay filter along the first axis
 
-            x = df[df.columns[0]].values
+    Parameters
+    ----------
+    values : 2-D array
+        Spectra matrix with one spectrum per column
 
-            drub = asym_baseline(dd) #uses asymmetric baseline algorithm
+    window_length : Int
+        Length of the filter window
 
-            #drub = rubberband(x, dd)
-            drub_df[i] = pd.Series(drub, name=colname)
-            dd = dd - drub
+    convolution : Str (default: 'direct')
+        `direct` filters all columns in one `savgol_filter` call. `fft`
+        convolves the interior points with the filter coefficients through
+        FFTs, which is faster for large windows, and fits the edges the same
+        way as `savgol_filter`.
+    """
+    from scipy.signal import savgol_filter, savgol_coeffs, fftconvolve
+
+    if convolution == 'direct':
+        return savgol_filter(values, deriv=2, window_length=window_length,
+                             polyorder=3, axis=0)
+    elif convolution != 'fft':
+        raise NameError('name {0} is not a supported convolution method'
+                        ''.format(convolution))
+
+    if values.shape[0] < window_length:
+        raise ValueError('window_length must be less than or equal to the '
+                         'number of frequencies')
+    half = window_length // 2
+    coeffs = savgol_coeffs(window_length, 3, deriv=2, use='conv')
+    result = np.empty_like(values, dtype=float)
+    result[half:len(values) - half] = fftconvolve(
+        values, coeffs[:, None], mode='valid', axes=0)
+    # Edges are polynomial fits over the first and last windows
+    result[:half] = savgol_filter(values[:window_length], deriv=2,
+                                  window_length=window_length, polyorder=3,
+                                  axis=0)[:half]
+    result[len(values) - half:] = savgol_filter(
+        values[-window_length:], deriv=2, window_length=window_length,
+        polyorder=3, axis=0)[window_length - half:]
+    return result
+
+
+@instrumented
+@accepts_spectra
+def find_deriv(df, flip, window_length=5, convolution='direct'):
+    """Adds the 2nd derivative of the chosen signal to the DataFrame
+        Window_length=5 is recommended from our studies
 
-        else:
-            dd = savgol_filter(
-                df[i], deriv=2, window_length=window_length, polyorder=3)
+    All spectra are filtered in a single pass over the spectra matrix, and
+    the result frame is built once. `convolution='fft'` uses FFT based
+    convolution, which is faster for large `window_length` values."""
+    proteins = list(df.columns)[1:]
+    values = df[proteins].to_numpy(dtype=float)
+    dd = _savgol_second_derivative(values, window_length, convolution)
 
-        dd = pd.Series(dd, name=colname)
+    if flip:
+        # negative if want flipped
+        dd = -1 * dd
+        dd -= als_baseline(dd) #uses asymmetric baseline algorithm
+
+    deriv_df = pd.DataFrame(dd, index=df.index,
+                            columns=[str(i) + '_deriv' for i in proteins])
+    deriv_df.insert(0, df.columns[0], df.iloc[:, 0])
+    deriv_df.columns = deriv_df.columns.str.replace(r"_deriv", "")
+    return deriv_df
 
-        df = pd.concat([df, dd], axis=1)
-        df = df[df.columns.drop(str(i))]
-    df.columns = df.columns.str.replace(r"_deriv", "")
-    return df
 
-def find_deriv2(deriv_df, flip, window_length=5):
+@instrumented
+@accepts_spectra
+def find_deriv2(deriv_df, flip, window_length=5, convolution='direct'):
     """Adds the 2nd derivative of the chosen signal to the DataFrame
         Window_length=5 is recommended from our studies"""
-    from scipy.signal import savgol_filter
-
     proteins = list(deriv_df.columns)[1:]
-    drub_df = deriv_df[[deriv_df.columns[0]]].copy()
-    for i in proteins:
-#         colname = str(i) + '_deriv'
+    values = deriv_df[proteins].to_numpy(dtype=float)
+    dd = _savgol_second_derivative(values, window_length, convolution)
 
-        if flip:
-            # negative if want flipped
-            dd = -1 * savgol_filter(deriv_df[i], deriv=2,
-                                    window_length=window_length, polyorder=3
-                                    )
+    if flip:
+        # negative if want flipped
+        dd = -1 * dd
 
-            x = deriv_df[deriv_df.columns[0]].values
+    result = pd.DataFrame(dd, index=deriv_df.index,
+                          columns=[str(i) for i in proteins])
+    result.insert(0, deriv_df.columns[0], deriv_df.iloc[:, 0])
+    return result
 
-#             drub = asym_baseline(dd) #uses asymmetric baseline algorithm
 
-            #drub = rubberband(x, dd)
-#             drub_df[i] = pd.Series(drub, name=str(i))
-#             dd = dd - drub
+@lru_cache(maxsize=16)
+def _als_penalty(length, lam):
+    """ Returns the banded second difference penalty `lam * D D^T`
 
-        else:
-            dd = savgol_filter(
-                deriv_df[i], deriv=2, window_length=window_length, polyorder=3)
+    The pentadiagonal penalty matrix is returned in the upper banded form
+    used by `scipy.linalg.solveh_banded`, and is cached for each signal
+    length and lambda value.
+    """
+    D = sparse.diags([1., -2., 1.], [0, -1, -2], shape=(length, length - 2))
+    penalty = (lam * D.dot(D.transpose())).todia()
+    banded = np.zeros((3, length))
+    for k in range(3):
+        banded[2 - k, k:] = penalty.diagonal(k)
+    banded.flags.writeable = False
+    return banded
 
-        dd = pd.Series(dd, name=str(i))
-        deriv_df = pd.concat([deriv_df.iloc[:,0], dd], axis=1)
 
-#         deriv_df[i] = dd
-#         df = df[df.columns.drop(str(i))]
+@instrumented
+def als_baseline(y, lam=10**2.5, p=0.007, niter=10):
+    """ Asymmetric least squares baseline of one or many spectra
+
+    Iteratively reweighted smoothing where points above the baseline get a
+    weight of `p` and points below it a weight of `1 - p`. The penalty matrix
+    is cached for each signal length and `lam`, every system is solved with
+    a symmetric banded (pentadiagonal) solver, and the iterations stop once
+    the weights of a spectrum no longer change.
+
+    Parameters
+    ----------
+    y : 1-D or 2-D array
+        Spectrum, or a 2-D array with one spectrum per column
+
+    lam : Float (default: 10**2.5)
+        Smoothness penalty
+
+    p : Float (default: 0.007)
+        Asymmetry weight for points above the baseline
+
+    niter : Int (default: 10)
+        Maximum number of reweighting iterations
+
+    Returns
+    -------
+    array
+        Baseline(s) with the same shape as `y`
+    """
+    y = np.asarray(y, dtype=float)
+    spectra = y.reshape(len(y), -1)
+    penalty = _als_penalty(len(y), lam)
+    baselines = np.empty_like(spectra)
+    system = np.empty_like(penalty)
+
+    for i in range(spectra.shape[1]):
+        spectrum = spectra[:, i]
+        w = np.ones(len(y))
+        for _ in range(niter):
+            system[:] = penalty
+            system[2] += w
+            try:
+                z = solveh_banded(system, w * spectrum, check_finite=False)
+            except LinAlgError:
+                # Not positive definite (e.g. zero weights): use a general
+                # banded solve of the same system
+                general = np.zeros((5, len(y)))
+                general[:3] = system
+                general[3, :-1] = system[1, 1:]
+                general[4, :-2] = system[0, 2:]
+                z = solve_banded((2, 2), general, w * spectrum)
+            w_new = p * (spectrum > z) + (1 - p) * (spectrum < z)
+            if np.array_equal(w_new, w):
+                break
+            w = w_new
+        baselines[:, i] = z
+    return baselines.reshape(y.shape)
 
-    return deriv_df
 
 def asym_baseline(y):
-    lam = 10**2.5
-    p = 0.007
-    niter = 10
-    L = len(y)
-    D = sparse.diags([1, -2, 1], [0, -1, -2], shape=(L, L - 2))
-    w = np.ones(L)
-    for i in range(niter):
-        W = sparse.spdiags(w, 0, L, L)
-        Z = W + lam * D.dot(D.transpose())
-        z = spsolve(Z, w * y)
-        w = p * (y > z) + (1 - p) * (y < z)
-    return z    
+    """ Returns the asymmetric least squares baseline of a spectrum """
+    return als_baseline(y)
+
+
+@instrumented
+def rubberband_baseline(x, y):
+    """ Rubberband (lower convex hull) baseline of one or many spectra
+
+    The lower convex hull vertices of each spectrum are found with
+    `scipy.spatial.ConvexHull`, and the baseline is the linear interpolation
+    between the hull vertices. The frequencies are sorted once for all the
+    spectra.
+
+    Parameters
+    ----------
+    x : 1-D array
+        Frequency values shared by all spectra, in any order
+
+    y : 1-D or 2-D array
+        Spectrum, or a 2-D array with one spectrum per column
 
+    Returns
+    -------
+    Tuple of arrays
+        Baselines and baseline corrected spectra, both with the same shape as
+        `y`
+    """
+    from scipy.spatial import ConvexHull
+    try:
+        from scipy.spatial import QhullError
+    except ImportError:
+        from scipy.spatial.qhull import QhullError
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    order = np.argsort(x, kind='stable')
+    xs = x[order]
+    ys = y.reshape(len(y), -1)[order]
+    n, count = ys.shape
+
+    baseline_sorted = np.empty((n, count))
+    for i in range(count):
+        try:
+            vertices = ConvexHull(np.column_stack([xs, ys[:, i]])).vertices
+        except QhullError:
+            # Fewer than three points, or all on a line: the baseline is the
+            # line between the end points
+            vertices = np.array([0, n - 1])
+        else:
+            # The vertices are counterclockwise, so the lower hull runs from
+            # the first to the last point in frequency order
+            vertices = np.roll(vertices, -vertices.argmin())
+            vertices = vertices[:vertices.argmax() + 1]
+        baseline_sorted[:, i] = np.interp(xs, xs[vertices], ys[vertices, i])
+
+    baselines = np.empty_like(baseline_sorted)
+    baselines[order] = baseline_sorted
+    baselines = baselines.reshape(y.shape)
+    return baselines, y - baselines
+
+
+@instrumented
+@accepts_spectra
 def sd_baseline_correction(df, cols=None, freq=0, flip=False, 
                            method='min', bounds=[1550,1750], inplace=False):
     """ Performs a baseline subtraction on second derivative spectra
@@ -121,9 +269,11 @@ def sd_baseline_correction(df, cols=None, freq=0, flip=False,
         assumed to be the index of the frequency range. 
     
     method :  Str (default: 'min')
-        Method used for baseline subtraction. Can be `min` or `rubberband`. 
-        `min` subtracts by the minimum value in the defined range. `rubberband`
-        applies a convexhull fit of the baseline around the defined range. 
+        Method used for baseline subtraction. Can be `min`, `asym` or
+        `rubberband`. `min` subtracts by the minimum value in the defined
+        range. `asym` returns the asymmetric least squares baseline itself
+        (see `als_baseline`), not the corrected spectra. `rubberband` applies
+        a convexhull fit of the baseline around the defined range. 
     
     flip : bool (default: False)
         A boolean to flip the data over the x-axis (i.e. muliply by -1)
@@ -144,38 +294,6 @@ def sd_baseline_correction(df, cols=None, freq=0, flip=False,
         """ `minimum` value subtraction function applied to the dataframe """
         return spec - spec.min()
     
-    def asym_baseline(y):
-        lam = 10**2.5
-        p = 0.007
-        niter = 10
-        L = len(y)
-        D = sparse.diags([1, -2, 1], [0, -1, -2], shape=(L, L - 2))
-        w = np.ones(L)
-        for i in range(niter):
-            W = sparse.spdiags(w, 0, L, L)
-            Z = W + lam * D.dot(D.transpose())
-            z = spsolve(Z, w * y)
-            w = p * (y > z) + (1 - p) * (y < z)
-        return z    
-
-    def rubberband(x, y):
-        """ `rubberband` subtraction function """
-        v = ConvexHull(np.column_stack([x, y])).vertices
-        
-        ascending = True if x[0] < x[1] else False
-        
-        if ascending:
-            # rotate vertices until they start from the lowest one
-            v = np.roll(v, -v.argmin())
-            v = v[:v.argmax() + 1]
-        else: 
-            # rotate vertices until they start from the highest one
-            v = np.roll(v, -v.argmax())
-            v = v[:v.argmin()+1]
-    
-        # Create baseline using linear interpolation between vertices
-        return y - np.interp(x, x[v], y[v])
-
     # get the frequency column name
     if freq not in df.columns and isinstance(freq, int):
         # get column name if an integer and not a column header
@@ -205,14 +323,16 @@ def sd_baseline_correction(df, cols=None, freq=0, flip=False,
         corrected_spectra = preprocessed_df.apply(minimum)
         
     elif method == 'asym':
-        corrected_spectra = preprocessed_df.apply(asym_baseline)
+        corrected_spectra = pd.DataFrame(
+            als_baseline(preprocessed_df.to_numpy(dtype=float)),
+            columns=preprocessed_df.columns)
         
     elif method == 'rubberband':
-        freqCol = filtered_df.iloc[:,0].values
-        vals = dict()
-        for colName, colData in preprocessed_df.iteritems():
-            vals[colName] = rubberband(freqCol, colData.values)
-        corrected_spectra = pd.DataFrame(data=vals)
+        freqCol = filtered_df.iloc[:,0].to_numpy(dtype=float)
+        _, corrected = rubberband_baseline(
+            freqCol, preprocessed_df.to_numpy(dtype=float))
+        corrected_spectra = pd.DataFrame(corrected,
+                                         columns=preprocessed_df.columns)
 
     else:
         raise NameError('name {0} is not a supported baseline method'
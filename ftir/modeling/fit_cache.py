@@ -0,0 +1,261 @@
+"""
+Content-addressed memoization of peak fit results
+
+Re-fitting an unchanged spectrum repeats the whole optimization, which can
+take a long time for differential evolution. `FitCache` stores fit results
+keyed by a hash of everything that determines the fit: the spectrum, the
+frequency axis, the peak definitions, the peak width, the fitting method and
+its solver parameters. Results are kept in an in-memory LRU layer and,
+optionally, in a persistent on-disk layer, both with size limits.
+"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import tempfile
+import types
+from collections import OrderedDict
+
+import numpy as np
+
+from ftir.modeling.instrumentation import instrumented
+from ftir.modeling.peak_definitions import yang_h20_2015
+from ftir.spectra import accepts_spectra
+
+
+# Bump when the fitting functions change in a way that changes results
+FIT_CACHE_VERSION = 1
+
+
+def _describe_code(code):
+    """ Returns a hash of a code object's bytecode, constants and names """
+    digest = hashlib.sha256(code.co_code)
+    digest.update(json.dumps([code.co_consts, code.co_names],
+                             default=_describe).encode())
+    return digest.hexdigest()
+
+
+def _describe_callable(func):
+    """ Describes a callable by its name and, for Python functions, its
+    code, default arguments, closure values and bound instance, so that two
+    lambdas or two functions of the same name do not share a key
+    """
+    func = inspect.unwrap(func)
+    if isinstance(func, functools.partial):
+        return {'partial': func.func, 'args': func.args,
+                'keywords': func.keywords}
+    name = '{0}.{1}'.format(getattr(func, '__module__', ''),
+                            getattr(func, '__qualname__', repr(func)))
+    code = getattr(func, '__code__', None)
+    if code is None:
+        return name
+    closure = getattr(func, '__closure__', None) or ()
+    return {'name': name, 'code': _describe_code(code),
+            'defaults': getattr(func, '__defaults__', None),
+            'kwdefaults': getattr(func, '__kwdefaults__', None),
+            'closure': [_shallow(cell.cell_contents) for cell in closure],
+            'self': _shallow(getattr(func, '__self__', None))}
+
+
+def _shallow(value):
+    """ Describes closure values and bound instances, naming rather than
+    expanding callables so that recursive closures terminate
+    """
+    if callable(value) and not isinstance(value, type):
+        return '{0}.{1}'.format(getattr(value, '__module__', ''),
+                                getattr(value, '__qualname__', repr(value)))
+    return value
+
+
+def _describe(value):
+    """ json `default` hook: describes callables and arrays by content """
+    if isinstance(value, types.CodeType):
+        return _describe_code(value)
+    if callable(value):
+        return _describe_callable(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return repr(value)
+
+
+def fit_key(x, y, peaks, peak_width, method, params=None):
+    """ Returns the cache key of a fit
+
+    Parameters
+    ----------
+    x : 1-D array
+        Frequency axis
+
+    y : 1-D array
+        Absorbance data being fit
+
+    peaks : Dict
+        Peak definitions, e.g. `yang_h20_2015`
+
+    peak_width : Number
+        Maximum peak width
+
+    method : Callable
+        Fitting function, e.g. `gaussian_least_squares`
+
+    params : Dict (optional)
+        Solver parameters passed to the fitting function
+    """
+    digest = hashlib.sha256()
+    for array in (x, y):
+        array = np.ascontiguousarray(array, dtype=float)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    description = json.dumps(
+        {'version': FIT_CACHE_VERSION, 'peaks': peaks,
+         'peak_width': peak_width, 'method': method, 'params': params},
+        sort_keys=True, default=_describe)
+    digest.update(description.encode())
+    return digest.hexdigest()
+
+
+class FitCache(object):
+    """ Two level (memory and disk) LRU cache of fit results
+
+    Parameters
+    ----------
+    max_entries : Int (default: 1024)
+        Maximum number of results kept in memory
+
+    directory : Str (optional)
+        Folder for the persistent layer. If `None`, results are only cached
+        in memory.
+
+    max_bytes : Int (default: 256 MiB)
+        Maximum total size of the persistent layer. The least recently used
+        results are removed when it is exceeded.
+    """
+
+    def __init__(self, max_entries=1024, directory=None,
+                 max_bytes=256*1024**2):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def __contains__(self, key):
+        return key in self._memory or (
+            self.directory is not None and os.path.exists(self._path(key)))
+
+    def get(self, key, default=None):
+        """ Returns the cached result for a key, or `default` """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if self.directory is None:
+            return default
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return default
+        os.utime(path)
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        """ Stores a result in memory and, if enabled, on disk """
+        self._remember(key, value)
+        if self.directory is None:
+            return
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self._path(key))
+        except Exception:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self._evict_disk()
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        entries = list()
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                try:
+                    entries.append((os.path.getmtime(path),
+                                    os.path.getsize(path), path))
+                except OSError:
+                    continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def invalidate(self, key):
+        """ Removes a result from both layers """
+        self._memory.pop(key, None)
+        if self.directory is not None and os.path.exists(self._path(key)):
+            os.remove(self._path(key))
+
+    def clear(self):
+        """ Removes every result from both layers """
+        self._memory.clear()
+        if self.directory is not None:
+            for name in os.listdir(self.directory):
+                if name.endswith('.pkl'):
+                    os.remove(os.path.join(self.directory, name))
+
+
+@instrumented
+@accepts_spectra
+def cached_fit(df, col, fit, cache, peaks=yang_h20_2015, peak_width=5,
+               params=None):
+    """ Runs a fitting function through a `FitCache`
+
+    Parameters
+    ----------
+    df : DataFrame
+        pandas dataframe with the frequency data in the first column
+
+    col : Int or Str
+        Column name of the absorbance data to be fit
+
+    fit : Callable
+        Fitting function, e.g. `gaussian_least_squares`
+
+    cache : FitCache
+        Cache to look the result up in, and to store it in on a miss
+
+    peaks, peak_width, params : optional
+        Passed to the fitting function. `params=None` uses its defaults.
+
+    Returns
+    -------
+    Tuple
+        The `(areas, res)` result of the fitting function
+    """
+    kwargs = {'peaks': peaks, 'peak_width': peak_width}
+    if params is not None:
+        kwargs['params'] = params
+    key = fit_key(df.iloc[:, 0].to_numpy(dtype=float),
+                  df[col].to_numpy(dtype=float), peaks, peak_width, fit,
+                  params)
+    result = cache.get(key)
+    if result is None:
+        result = fit(df, col, **kwargs)
+        cache.put(key, result)
+    return result
@@ -0,0 +1,260 @@
+"""
+Per-stage timing and optimizer instrumentation
+
+The processing stages of `ftir.modeling` (`area_norm`, `find_deriv`,
+`sd_baseline_correction`, `buffer_subtract`, the Gaussian fitters, ...) are
+decorated with `instrumented`. While nothing is listening, the decorator only
+checks an empty list before calling the stage. Inside a `Recorder` block, or
+while a callback is registered, every stage call produces a record with:
+
+    stage, start, wall_time, depth, error
+        Stage name, start time (epoch seconds), wall time in seconds, nesting
+        depth (stages called from another stage have depth > 0) and the
+        exception raised by the stage, if any
+    input_shape, output_shape
+        Shape of the data argument and of the result
+    params
+        The scalar arguments of the call, e.g. `method` or `window_length`
+    allocated, peak_memory
+        Net and peak bytes allocated by the stage (`Recorder(memory=True)`
+        only, see `tracemalloc`)
+    nfev, nit, success, status, cost
+        Optimizer statistics of the fitting stages
+
+Example
+-------
+>>> with Recorder() as recorder:
+...     df = area_norm(df)
+...     fit_all(df, workers=1)
+>>> recorder.to_dataframe().groupby('stage').wall_time.sum()
+
+Stages run in worker processes (e.g. `fit_all` with `workers > 1`) are not
+recorded, only the calling stage is.
+"""
+import inspect
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from functools import wraps
+
+import numpy as np
+
+
+# Registered listeners. Each is called with every finished stage record.
+_listeners = []
+
+_local = threading.local()
+
+_SCALARS = (str, int, float, bool, type(None))
+
+
+def add_callback(callback):
+    """ Registers a callable called with the record of every stage call
+
+    Returns the callback, so this can be used as a decorator.
+    """
+    _listeners.append(callback)
+    return callback
+
+
+def remove_callback(callback):
+    """ Unregisters a callback added with `add_callback` """
+    _listeners.remove(callback)
+
+
+def enabled():
+    """ Returns whether any recorder or callback is listening """
+    return bool(_listeners)
+
+
+def _shape(value):
+    """ Returns the shape of array-like data, or `None` """
+    shape = getattr(value, 'shape', None)
+    if shape is None and isinstance(value, (list, tuple)) and value:
+        shape = getattr(value[0], 'shape', None)
+        if shape is not None:
+            shape = (len(value),) + tuple(shape)
+    return None if shape is None else tuple(int(i) for i in shape)
+
+
+def _fit_statistics(result):
+    """ Returns the optimizer statistics of an `(areas, res)` fit result """
+    if not (isinstance(result, tuple) and len(result) == 2 and
+            hasattr(result[1], 'x')):
+        return dict()
+    res = result[1]
+    cost = res.get('cost', res.get('fun'))
+    return {
+        'nfev': int(res.get('nfev', -1)),
+        'nit': int(res.get('nit', -1)),
+        'success': bool(res.get('success', False)),
+        'status': int(res.get('status', -1)),
+        'cost': None if cost is None else float(np.sum(cost)),
+    }
+
+
+def _params(signature, args, kwargs):
+    """ Returns the scalar arguments of a call, keyed by parameter name """
+    try:
+        bound = signature.bind(*args, **kwargs)
+    except TypeError:
+        return dict()
+    params = dict()
+    for name, value in bound.arguments.items():
+        kind = signature.parameters[name].kind
+        if kind == inspect.Parameter.VAR_KEYWORD:
+            params.update((k, v) for k, v in value.items()
+                          if isinstance(v, _SCALARS))
+        elif isinstance(value, _SCALARS):
+            params[name] = value
+        elif callable(value):
+            params[name] = getattr(value, '__name__', repr(value))
+    return params
+
+
+def instrumented(func=None, stage=None):
+    """ Decorator recording the calls of a processing stage
+
+    Parameters
+    ----------
+    func : Callable
+        Stage function. Its first argument is the data whose shape is
+        recorded.
+
+    stage : Str (optional)
+        Stage name used in the records. Defaults to the function name.
+    """
+    if func is None:
+        return lambda f: instrumented(f, stage)
+    name = stage or func.__name__
+    signature = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _listeners:
+            return func(*args, **kwargs)
+        return _record(name, signature, func, args, kwargs)
+    return wrapper
+
+
+def _record(name, signature, func, args, kwargs):
+    """ Calls a stage, then sends its record to every listener """
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    tracing = tracemalloc.is_tracing()
+    frame = {'child_peak': 0}
+    if tracing:
+        frame['memory'], frame['outer_peak'] = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+    record = {'stage': name, 'start': time.time(), 'depth': len(stack),
+              'input_shape': _shape(args[0]) if args else None,
+              'params': _params(signature, args, kwargs)}
+    stack.append(frame)
+    start = time.perf_counter()
+    error = None
+    try:
+        result = func(*args, **kwargs)
+        return result
+    except BaseException as e:
+        error = e
+        result = None
+        raise
+    finally:
+        record['wall_time'] = time.perf_counter() - start
+        stack.pop()
+        if tracing and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame['child_peak'])
+            record['allocated'] = current - frame['memory']
+            record['peak_memory'] = peak - frame['memory']
+            # Nested stages reset the peak, so pass it on to the caller
+            if stack:
+                stack[-1]['child_peak'] = max(stack[-1]['child_peak'], peak,
+                                              frame['outer_peak'])
+        record['error'] = None if error is None else repr(error)
+        record['output_shape'] = _shape(result)
+        record.update(_fit_statistics(result))
+        for listener in list(_listeners):
+            listener(record)
+
+
+class Recorder(object):
+    """ Context manager collecting the records of every stage call
+
+    Parameters
+    ----------
+    memory : bool (default: False)
+        Also record the net and peak memory allocated by each stage. This
+        starts `tracemalloc`, which slows down Python code considerably.
+
+    Attributes
+    ----------
+    records : list
+        The stage records, in the order the stages finished
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.records = []
+        self._lock = threading.Lock()
+        self._started_tracing = False
+
+    def __call__(self, record):
+        with self._lock:
+            self.records.append(record)
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        add_callback(self)
+        return self
+
+    def __exit__(self, *exc):
+        remove_callback(self)
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    def clear(self):
+        """ Removes all records """
+        with self._lock:
+            self.records = []
+
+    def to_dataframe(self):
+        """ Returns the records as a DataFrame, one row per stage call """
+        import pandas as pd
+        return pd.DataFrame.from_records(self.records)
+
+    def summary(self):
+        """ Returns the number of calls, total and mean wall time per stage,
+        sorted by total wall time
+        """
+        df = self.to_dataframe()
+        if df.empty:
+            return df
+        summary = df.groupby('stage')['wall_time'].agg(
+            ['count', 'sum', 'mean'])
+        return summary.sort_values('sum', ascending=False)
+
+    def to_log(self, logger=None, level=logging.INFO):
+        """ Logs every record as a json message
+
+        Parameters
+        ----------
+        logger : logging.Logger (optional)
+            Logger to write to. Defaults to the `ftir.instrumentation`
+            logger.
+
+        level : Int (default: logging.INFO)
+            Logging level of the messages
+        """
+        if logger is None:
+            logger = logging.getLogger('ftir.instrumentation')
+        for record in self.records:
+            logger.log(level, json.dumps(record, default=str),
+                       extra={'ftir_record': record})
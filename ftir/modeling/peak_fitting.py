@@ -26,7 +26,7 @@ Notes:
  clist has a zero y-value in the FTIR dataset:
     TypeError: Improper input: N=30 must not exceed M=1
 
- Program will throw a key error if the initial guess peaks in clist lie
+ Program will throw a value error if the initial guess peaks in clist lie
  outside the x-data range
 
  Sometimes you need to tweak the initial guess peaks (in clist) to get the fit
@@ -37,12 +37,22 @@ Notes:
 """
 
 import math
+import os
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+from ftir.modeling.derivative import rubberband_baseline
+from ftir.modeling.instrumentation import instrumented
 from ftir.modeling.peak_definitions import yang_h20_2015
 from scipy import optimize
-from scipy.spatial import ConvexHull
+from ftir.spectra import accepts_spectra
+
+
+# `optimize.minimize` solvers that make use of the objective gradient
+GRADIENT_METHODS = ('cg', 'bfgs', 'newton-cg', 'l-bfgs-b', 'tnc', 'slsqp',
+                    'trust-constr', 'dogleg', 'trust-ncg', 'trust-exact',
+                    'trust-krylov')
 
 
 def _split_result_array(res):
@@ -59,6 +69,8 @@ def _split_result_array(res):
     return centers, width, height,
 
 
+@instrumented
+@accepts_spectra
 def sd_baseline_correction(df, cols=None, freq=0, flip=False, 
                            method='min', bounds=[1550,1750], inplace=False):
     """ Performs a baseline subtraction on second derivative spectra
@@ -114,24 +126,6 @@ def sd_baseline_correction(df, cols=None, freq=0, flip=False,
         """ `minimum` value subtraction function applied to the dataframe """
         return spec - spec.min()
 
-    def rubberband(x, y):
-        """ `rubberband` subtraction function """
-        v = ConvexHull(np.column_stack([x, y])).vertices
-        
-        ascending = True if x[0] < x[1] else False
-        
-        if ascending:
-            # rotate vertices until they start from the lowest one
-            v = np.roll(v, -v.argmin())
-            v = v[:v.argmax() + 1]
-        else: 
-            # rotate vertices until they start from the highest one
-            v = np.roll(v, -v.argmax())
-            v = v[:v.argmin()+1]
-    
-        # Create baseline using linear interpolation between vertices
-        return y - np.interp(x, x[v], y[v])
-
     # get the frequency column name
     if freq not in df.columns and isinstance(freq, int):
         # get column name if an integer and not a column header
@@ -161,11 +155,11 @@ def sd_baseline_correction(df, cols=None, freq=0, flip=False,
         corrected_spectra = preprocessed_df.apply(minimum)
         
     elif method == 'rubberband':
-        freqCol = filtered_df.iloc[:,0].values
-        vals = dict()
-        for colName, colData in preprocessed_df.iteritems():
-            vals[colName] = rubberband(freqCol, colData.values)
-        corrected_spectra = pd.DataFrame(data=vals)
+        freqCol = filtered_df.iloc[:,0].to_numpy(dtype=float)
+        _, corrected = rubberband_baseline(
+            freqCol, preprocessed_df.to_numpy(dtype=float))
+        corrected_spectra = pd.DataFrame(corrected,
+                                         columns=preprocessed_df.columns)
 
     else:
         raise NameError('name {0} is not a supported baseline method'
@@ -179,13 +173,68 @@ def sd_baseline_correction(df, cols=None, freq=0, flip=False,
 
 
 
+@instrumented
+@accepts_spectra
 def gaussian_least_squares(df, col, peaks=yang_h20_2015,
-                           peak_width=5, params=dict()):
+                           peak_width=5, params=dict(), x0=None,
+                           truncate=None):
+    """
+    Least squares implementation of the FTIR peak fitting
+
+    Uses the Scipy `optimize.least_squares` function with the analytic
+    Jacobian of the Gaussian model. The finite difference Jacobian estimate
+    can be restored by passing a `jac` value (e.g. `'2-point'`) in `params`.
+
+    Parameters
+    ----------
+    df : DataFrame
+        pandas dataframe containing the FTIR data. The data must be contain a
+        column of the wavenumber data, and a column of the spectral data.
+
+    col : Int or Str
+        Column index for the absorbance data to be fit.
+
+    peaks : Peak Definitions (optional)
+        A dictionary containing peak definitions to be used. Defaults to the
+        Yang et. al, Nature Protocol 2015. peak definitions.
+
+    peak_width : Int (optional)
+        Maximum peak width. Defaults to 5
+
+    params : Dict (optional)
+        A dictionary of kwargs passed to the scipy least squares optimization
+        algorithm.
+
+    x0 : 1-D array (optional)
+        Starting parameters (peak_height, peak_mean, peak_width)_{n}, e.g. the
+        converged `res.x` of a similar spectrum. Values are clipped to the
+        fit bounds, and NaN values are replaced by the default start. Defaults
+        to the guessed heights, the peak means and the maximum peak width.
+
+    truncate : Float (optional)
+        If given, each peak is only evaluated within `truncate` maximum peak
+        widths of its center bounds (see `GaussianWindows`), and the
+        Jacobian is sparse. This is much faster for wide frequency ranges,
+        e.g. Amide I and II. A `jac` value in `params` then uses the
+        corresponding `jac_sparsity`. Defaults to `None`, which evaluates
+        every peak over the whole frequency range.
+
+    Returns
+    -------
+    Tuple
+        List of the peak areas and the scipy optimization result.
+    """
 
     def fun(p, x, y):
         """ Minimizing across parameter space p, for a given range, x"""
         return gaussian_sum(x, *p) - y
 
+    def jac(p, x, y):
+        """ Analytic Jacobian of the residuals `fun` """
+        return gaussian_jacobian(x, *p)
+
+    params = dict(params)
+    params.setdefault('jac', jac)
     data = np.array(pd.concat([df.iloc[:,0], df[col]], axis=1))
     heights = guess_heights(df, col, peaks['means'], gain=1.0)
     width = peak_width
@@ -201,6 +250,18 @@ def gaussian_least_squares(df, col, peaks=yang_h20_2015,
         ub.extend([ubh, bound[1], peak_width*1])
         guess.extend([height*0.95, mean, peak_width])
 
+    if truncate is not None:
+        windows = GaussianWindows(data[:, 0], peaks['uncertainties'],
+                                  peak_width, truncate)
+        fun = lambda p, x, y: windows.model(p) - y
+        if params['jac'] is jac:
+            params['jac'] = lambda p, x, y: windows.jacobian(p)
+        else:
+            params.setdefault('jac_sparsity', windows.sparsity)
+
+    if x0 is not None:
+        x0 = np.asarray(x0, dtype=float)
+        guess = np.clip(np.where(np.isnan(x0), guess, x0), lb, ub)
     args = [fun, np.array(guess)]
     params['args'] = (data[:, 0], data[:, 1])
     params['bounds'] = (np.array(lb), np.array(ub))
@@ -215,9 +276,11 @@ def gaussian_least_squares(df, col, peaks=yang_h20_2015,
     return areas, res
 
 
+@instrumented
+@accepts_spectra
 def gaussian_minimize(
         df, col, peaks=yang_h20_2015, peak_width=5,
-        params={'method': 'L-BFGS-B'}):
+        params={'method': 'L-BFGS-B'}, x0=None):
     """
     Gradient based minimization implementation of the FTIR peak fitting
 
@@ -258,9 +321,16 @@ def gaussian_minimize(
         Defaults to the Yang et. al, Nature Protocol 2015. peak definitions.
 
     params : Dict (optional)
-        A dictionary of kwargs passed to the scipy differential evolution
-        optimization algorithm. If `None`, the Default settings within scipy
-        are used.
+        A dictionary of kwargs passed to the scipy minimize optimization
+        algorithm. If `None`, the Default settings within scipy are used. For
+        the gradient based solvers, the analytic gradient of the objective is
+        used unless a `jac` value is provided.
+
+    x0 : 1-D array (optional)
+        Starting parameters (peak_height, peak_mean, peak_width)_{n}, e.g. the
+        converged `res.x` of a similar spectrum. Values are clipped to the
+        fit bounds, and NaN values are replaced by the default start. Defaults
+        to the guessed heights, the peak means and the maximum peak width.
 
 
     Returns
@@ -286,6 +356,19 @@ def gaussian_minimize(
         """
         return np.sum((gaussian_sum(x, *p) - y)**2)
 
+    def func_and_grad(p, x, y):
+        """ Returns the objective `func` and its analytic gradient """
+        resid = gaussian_sum(x, *p) - y
+        return np.sum(resid**2), 2 * resid.dot(gaussian_jacobian(x, *p))
+
+    params = dict(params)
+    method = params.get('method')
+    use_gradient = 'jac' not in params and (
+        method is None or method.lower() in GRADIENT_METHODS)
+    if use_gradient:
+        func = func_and_grad
+        params['jac'] = True
+
     data = np.array(pd.concat([df.iloc[:,0], df[col]], axis=1))
     heights = guess_heights(df, col, peaks['means'], gain=1.0)
     width = peak_width*1
@@ -302,6 +385,10 @@ def gaussian_minimize(
         guess.append(mean)
         guess.append(peak_width)
 
+    if x0 is not None:
+        lower, upper = np.array(bounds, dtype=float).T
+        x0 = np.asarray(x0, dtype=float)
+        guess = np.clip(np.where(np.isnan(x0), guess, x0), lower, upper)
     args = [func, np.array(guess)]
     params['args'] = (data[:, 0], data[:, 1])
     params['bounds'] = bounds
@@ -316,9 +403,208 @@ def gaussian_minimize(
     return areas, res
 
 
+
+
+def _solve_heights(design, y, upper):
+    """ Returns the least squares peak heights within [0, upper] """
+    heights, _ = optimize.nnls(design, y)
+    # The non-negative solution is also optimal within the upper bounds if
+    # it satisfies them
+    if (heights <= upper).all():
+        return heights
+    return optimize.lsq_linear(design, y, bounds=(0, upper),
+                               method='bvls').x
+
+
+@instrumented
+@accepts_spectra
+def gaussian_variable_projection(df, col, peaks=yang_h20_2015, peak_width=5,
+                                 params=dict(), x0=None, bound_heights=False):
+    """
+    Variable projection (separable least squares) implementation of the FTIR
+    peak fitting
+
+    The Gaussian model is linear in the peak heights. For every trial set of
+    peak centers and widths, the heights are solved exactly by bounded
+    non-negative least squares against the matrix of unit height peaks, so
+    the Scipy `optimize.least_squares` search only runs over the 2n centers
+    and widths. The Jacobian of the projected residuals uses the Kaufman
+    approximation.
+
+    Peaks whose height is solved as zero do not change the residuals, so
+    their center and width stay where they are. Starting from narrower peaks
+    (half the maximum width) keeps most heights positive at the start. The
+    heights are bounded by the largest absolute absorbance and the widths
+    below by a tenth of the maximum peak width, so a peak cannot collapse
+    into a tall spike between two frequency points.
+
+    Parameters
+    ----------
+    df : DataFrame
+        pandas dataframe containing the FTIR data. The data must be contain a
+        column of the wavenumber data, and a column of the spectral data.
+
+    col : Int or Str
+        Column index for the absorbance data to be fit.
+
+    peaks : Peak Definitions (optional)
+        A dictionary containing peak definitions to be used. Defaults to the
+        Yang et. al, Nature Protocol 2015. peak definitions.
+
+    peak_width : Int (optional)
+        Maximum peak width. Defaults to 5
+
+    params : Dict (optional)
+        A dictionary of kwargs passed to the scipy least squares optimization
+        algorithm.
+
+    x0 : 1-D array (optional)
+        Starting parameters (peak_height, peak_mean, peak_width)_{n}, e.g. the
+        converged `res.x` of a similar spectrum. Only the centers and widths
+        are used, clipped to the fit bounds, and NaN values are replaced by
+        the default start. Defaults to the peak means and half the maximum
+        peak width.
+
+    bound_heights : bool (default: False)
+        If True, the heights are bounded above by the guessed heights, as in
+        `gaussian_least_squares`. Otherwise they are only bounded by the
+        largest absolute absorbance.
+
+    Returns
+    -------
+    Tuple
+        List of the peak areas and the scipy optimization result. As for the
+        other fitting functions, `res.x` holds the full (peak_height,
+        peak_mean, peak_width)_{n} parameters.
+    """
+    data = np.array(pd.concat([df.iloc[:, 0], df[col]], axis=1))
+    x, y = data[:, 0], data[:, 1]
+    heights = np.asarray(guess_heights(df, col, peaks['means'], gain=1.0))
+    upper = np.full(len(heights), np.abs(y).max())
+    if bound_heights:
+        upper = np.where(heights <= 0, upper, heights)
+    n = len(peaks['means'])
+    min_width = peak_width / 10
+
+    lb = np.column_stack([[b[0] for b in peaks['uncertainties']],
+                          np.full(n, min_width)]).ravel()
+    ub = np.column_stack([[b[1] for b in peaks['uncertainties']],
+                          np.full(n, float(peak_width))]).ravel()
+    guess = np.column_stack([peaks['means'],
+                             np.full(n, peak_width/2)]).ravel()
+    if x0 is not None:
+        start = np.asarray(x0, dtype=float).reshape(-1, 3)[:, 1:].ravel()
+        guess = np.where(np.isnan(start), guess, start)
+    guess = np.clip(guess, lb, ub)
+
+    last = {}
+
+    def project(q):
+        """ Returns the full parameters and model Jacobian for centers and
+        widths `q`, solving the heights
+        """
+        if last.get('q') is not None and np.array_equal(last['q'], q):
+            return last['p'], last['jacobian']
+        p = np.empty(3*n)
+        p[0::3] = 1
+        p[1::3] = q[0::2]
+        p[2::3] = q[1::2]
+        jacobian = gaussian_jacobian(x, *p)
+        p[0::3] = _solve_heights(jacobian[:, 0::3], y, upper)
+        # Center and width derivatives scale with the peak heights
+        jacobian[:, 1::3] *= p[0::3]
+        jacobian[:, 2::3] *= p[0::3]
+        last.update(q=q.copy(), p=p, jacobian=jacobian)
+        return p, jacobian
+
+    def fun(q):
+        p, jacobian = project(q)
+        return jacobian[:, 0::3] @ p[0::3] - y
+
+    def jac(q):
+        p, jacobian = project(q)
+        derivatives = np.empty((len(x), 2*n))
+        derivatives[:, 0::2] = jacobian[:, 1::3]
+        derivatives[:, 1::2] = jacobian[:, 2::3]
+        # Project out the span of the peaks whose heights are not at a bound
+        free = (p[0::3] > 0) & (p[0::3] < upper)
+        if free.any():
+            basis, _ = np.linalg.qr(jacobian[:, 0::3][:, free])
+            derivatives -= basis @ (basis.T @ derivatives)
+        return derivatives
+
+    params = dict(params)
+    params.setdefault('jac', jac)
+    params.setdefault('x_scale', 'jac')
+    params['bounds'] = (lb, ub)
+    res = optimize.least_squares(fun, guess, **params)
+
+    p, _ = project(res.x)
+    res.nonlinear_x = res.x
+    res.x = p
+    areas = [gaussian_integral(p[i], p[i+2]) for i in range(0, len(p), 3)]
+    return areas, res
+
+
+def _sum_squared_residuals(p, x, y):
+    """ Sum of the squared residuals of the gaussian model
+
+    Parameters
+    ----------
+    p : 1-D or 2-D array
+        Inputs are a 1-D array that follow the sequence:
+        (peak_height, peak_mean, peak_width)_{n}. A 2-D array of shape
+        (3n, S) evaluates S parameter vectors at once.
+
+    x : 1-D array
+        Frequency range for evaluation
+
+    y : 1-D array
+        Measured absorbance data corresponding to the frequency range
+        provided
+    """
+    model = gaussian_model(x, p)
+    if model.ndim == 2:
+        y = y[:, None]
+    return np.sum((model - y)**2, axis=0)
+
+
+class _StructureConvergence(object):
+    """ Differential evolution callback for early stopping
+
+    Stops the optimization once the secondary structure content of the best
+    population member has not changed by more than `tol` (in absolute
+    fraction) for `patience` consecutive generations.
+    """
+
+    def __init__(self, peaks, tol, patience):
+        self.peaks = peaks
+        self.tol = tol
+        self.patience = patience
+        self.previous = None
+        self.stable = 0
+
+    def __call__(self, xk, convergence=None):
+        areas = [gaussian_integral(h, w) for h, w in zip(xk[0::3], xk[2::3])]
+        if sum(areas) <= 0:
+            return False
+        current = secondary_structure(areas, self.peaks)
+        if self.previous is not None and all(
+                abs(current[k] - self.previous[k]) <= self.tol
+                for k in current):
+            self.stable += 1
+        else:
+            self.stable = 0
+        self.previous = current
+        return self.stable >= self.patience
+
+
+@instrumented
+@accepts_spectra
 def gaussian_differential_evolution(
         df, col, peaks=yang_h20_2015, peak_width=5,
-        params=dict()):
+        params=dict(), workers=1, polish=True, structure_tol=1e-3,
+        patience=25):
     """
     Differential evolution minimization implementation of the FTIR peak fitting
 
@@ -329,9 +615,12 @@ def gaussian_differential_evolution(
     minimum than other approaches, e.g. least squared optimization. The
     advantage of this approach is that we can define the bounds of the peak
     positions, and search of the global minima within this defined bounds
-    without the worry of converging on a local minimum. The disadvantage is
-    that is takes a really long time to run. Like hit go and walk away for a
-    couple hours long.
+    without the worry of converging on a local minimum.
+
+    The whole population is scored in one vectorized call of the gaussian
+    model each generation (or spread over a pool of `workers` processes),
+    the evolution stops early once the secondary structure content stops
+    changing, and the best member is polished with the least squares fit.
 
     Parameters
     ----------
@@ -369,30 +658,29 @@ def gaussian_differential_evolution(
         optimization algorithm. If `None`, the Default settings within scipy
         are used.
 
+    workers : Int (optional)
+        Number of processes used to score the population. Defaults to 1,
+        which scores the whole population in a single vectorized call. Values
+        other than 1 are passed to scipy, and `-1` uses all available CPUs.
+
+    polish : bool (optional)
+        If `True` (default), the best population member is refined with a
+        bounded least squares fit using the analytic Jacobian.
+
+    structure_tol : Float (optional)
+        Absolute change in the secondary structure fractions below which a
+        generation is considered unchanged. Defaults to 1e-3. `None` disables
+        early stopping.
+
+    patience : Int (optional)
+        Number of consecutive unchanged generations after which the evolution
+        is stopped. Defaults to 25.
 
     Returns
     -------
     TBD
     """
 
-    def func(p, x, y):
-        """Function to find the local minimum in the boundary space
-
-        Parameters
-        ----------
-        p : 1-D array
-            Inputs are a 1-D array that follow the sequence:
-            (peak_mean, peak_height, peak_width)_{n}
-
-        x : 1-D array
-            Frequency range for evaluation
-
-        y : 1-D array
-            Measured absorbance data corresponding to the frequency range
-            provided
-        """
-        return np.sum((gaussian_sum(x, *p) - y)**2)
-
     data = np.array(pd.concat([df.iloc[:,0], df[col]], axis=1))
     heights = guess_heights(df, col, peaks['means'], gain=1.0)
     width = peak_width
@@ -402,56 +690,332 @@ def gaussian_differential_evolution(
         bounds.append((0, height))
         bounds.append(bound)
         bounds.append((0, width))
+    bounds = np.array(bounds)
 
-    args = [func, np.array(bounds)]
+    params = dict(params)
     params['args'] = (data[:, 0], data[:, 1])
-    res = optimize.differential_evolution(*args, **params)
+    if workers == 1:
+        params.setdefault('vectorized', True)
+        params.setdefault('updating', 'deferred')
+    else:
+        params.setdefault('workers', workers)
+        params.setdefault('updating', 'deferred')
+    # The best member is polished below with the bounded least squares fit
+    params['polish'] = False
+    if structure_tol is not None and 'callback' not in params:
+        params['callback'] = _StructureConvergence(peaks, structure_tol,
+                                                   patience)
+    res = optimize.differential_evolution(
+        _sum_squared_residuals, bounds, **params)
+
+    if polish:
+        ls = optimize.least_squares(
+            lambda p, x, y: gaussian_sum(x, *p) - y, res.x,
+            jac=lambda p, x, y: gaussian_jacobian(x, *p),
+            bounds=(bounds[:, 0], bounds[:, 1]), args=params['args'])
+        res.nfev += ls.nfev
+        if 2 * ls.cost < res.fun:
+            res.x = ls.x
+            res.fun = 2 * ls.cost
 
     areas = []
     centers, width, height = _split_result_array(res)
-    for a, b in zip(heights, width):
+    for a, b in zip(height, width):
         area = gaussian_integral(a, b)
         areas.append(area)
     return areas, res
 
 
-def guess_heights(df, col, center_list, gain=0.95):
+def _start_points(lower, upper, starts, sampling, seed):
+    """ Returns `starts` space filling points within the bounds, one per row
+    """
+    from scipy.stats import qmc
+
+    if sampling == 'sobol':
+        sampler = qmc.Sobol(len(lower), seed=seed)
+        # Sobol points are balanced in powers of two
+        sample = sampler.random_base2(int(np.ceil(np.log2(max(starts, 1)))))
+        sample = sample[:starts]
+    elif sampling in ('lhs', 'latin_hypercube'):
+        sample = qmc.LatinHypercube(len(lower), seed=seed).random(starts)
+    else:
+        raise NameError('name {0} is not a supported sampling method. Use '
+                        'sobol or lhs'.format(sampling))
+    return qmc.scale(sample, lower, upper)
+
+
+@instrumented
+@accepts_spectra
+def gaussian_multistart(
+        df, col, peaks=yang_h20_2015, peak_width=5, params=dict(),
+        starts=32, sampling='sobol', workers=1, patience=8, tol=1e-6,
+        seed=None):
+    """
+    Multi-start least squares implementation of the FTIR peak fitting
+
+    A middle ground between the local `gaussian_least_squares` fit and the
+    global `gaussian_differential_evolution` search. The bounded least
+    squares fit is run from the default initial guess and from up to
+    `starts - 1` starting points spread over the parameter bounds by Sobol
+    or Latin hypercube sampling, and the fit with the lowest cost is kept.
+    The fits run on a pool of `workers` processes, and no new fits are
+    started once the best cost has not improved for `patience` fits.
+
+    Parameters
+    ----------
+    df : DataFrame
+        pandas dataframe containing the FTIR data. The data must be contain a
+        column of the wavenumber data, and a column of the spectral data.
+
+    col : Int or Str
+        Column index for the absorbance data to be fit.
+
+    peaks : Peak Definitions (optional)
+        A dictionary containing peak definitions to be used. Defaults to the
+        Yang et. al, Nature Protocol 2015. peak definitions.
+
+    peak_width : Int (optional)
+        Maximum peak width. Defaults to 5
+
+    params : Dict (optional)
+        A dictionary of kwargs passed to the scipy least squares optimization
+        algorithm of every fit.
+
+    starts : Int (optional)
+        Maximum number of fits, including the fit from the default guess.
+        Must be at least 1, which only runs the fit from the default guess.
+        Defaults to 32.
+
+    sampling : Str (optional)
+        Sampling of the starting points, `sobol` (default) or `lhs` (Latin
+        hypercube). Heights are sampled up to the guessed heights, centers
+        within the peak `uncertainties` and widths between a tenth of and
+        the maximum peak width.
+
+    workers : Int (optional)
+        Number of processes running the fits. Defaults to 1, which runs them
+        in the current process. `-1` uses all available CPUs.
+
+    patience : Int (optional)
+        Number of consecutive fits without improvement of the best cost
+        after which no new fits are started. Defaults to 8. `None` runs all
+        `starts` fits.
+
+    tol : Float (optional)
+        Relative decrease of the best cost counted as an improvement.
+        Defaults to 1e-6.
+
+    seed : Int (optional)
+        Seed of the starting point sampling
+
+    Returns
+    -------
+    Tuple
+        List of the peak areas and the scipy optimization result of the best
+        fit. The result also holds the number of fits run (`starts`), the
+        cost of each fit in the order they finished (`start_costs`) and the
+        total number of function evaluations of all fits (`total_nfev`).
+    """
+    from concurrent.futures import (ProcessPoolExecutor, FIRST_COMPLETED,
+                                    wait)
+    from ftir.modeling.batch_fitting import _fit_column
+
+    if starts < 1:
+        raise ValueError('At least one start is required, got starts={0}'
+                         ''.format(starts))
+    x = df.iloc[:, 0].to_numpy(dtype=float)
+    y = df[col].to_numpy(dtype=float)
+    heights = np.asarray(guess_heights(df, col, peaks['means'], gain=1.0))
+    n = len(peaks['means'])
+    lower = np.empty(3*n)
+    upper = np.empty(3*n)
+    lower[0::3] = 0
+    upper[0::3] = np.where(heights <= 0, np.abs(y).max(), heights)
+    lower[1::3], upper[1::3] = np.array(peaks['uncertainties'], dtype=float).T
+    lower[2::3] = peak_width/10
+    upper[2::3] = peak_width
+    points = [None]
+    if starts > 1:
+        points.extend(_start_points(lower, upper, starts - 1, sampling, seed))
+    tasks = iter([('least_squares', x, y, col, peaks, peak_width, params, x0)
+                  for x0 in points])
+
+    best = None
+    costs = list()
+    total_nfev = 0
+    stale = 0
+
+    def finished(result):
+        nonlocal best, stale, total_nfev
+        total_nfev += result[1].nfev
+        costs.append(float(result[1].cost))
+        if best is None or result[1].cost < best[1].cost*(1 - tol):
+            best = result
+            stale = 0
+        else:
+            stale += 1
+        return patience is not None and stale >= patience
+
+    if workers == 1:
+        for task in tasks:
+            if finished(_fit_column(*task)):
+                break
+    else:
+        if workers == -1:
+            workers = os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            running = set()
+            stop = False
+            while True:
+                # Keep every worker busy until the fits stop improving
+                while not stop and len(running) < workers:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    running.add(executor.submit(_fit_column, *task))
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stop = finished(future.result()) or stop
+
+    areas, res = best
+    res.starts = len(costs)
+    res.start_costs = costs
+    res.total_nfev = total_nfev
+    return areas, res
+
+
+class FrequencyIndex(object):
+    """ Sorted index of a frequency axis for absorbance lookups
+
+    The index is built once per frequency axis and can be reused for every
+    sample column measured on that axis. Absorbance values at arbitrary
+    frequencies are linearly interpolated between the neighbouring measured
+    frequencies, so the frequencies do not need to fall on the measured grid.
+
+    Parameters
+    ----------
+    freq : 1-D array
+        Measured frequencies. The frequencies can be in any order.
+    """
+
+    def __init__(self, freq):
+        freq = np.asarray(freq, dtype=float)
+        if freq.size < 2:
+            raise ValueError('At least two frequencies are required to build '
+                             'a frequency index')
+        self.order = np.argsort(freq, kind='stable')
+        self.sorted_freq = freq[self.order]
+
+    def lookup(self, values, frequencies):
+        """ Returns the absorbance values at the given frequencies
+
+        Parameters
+        ----------
+        values : 1-D or 2-D array
+            Absorbance values ordered the same as the indexed frequency axis.
+            A 2-D array with one column per sample returns the values for all
+            samples at once.
+
+        frequencies : iterable of numbers
+            Frequencies at which the absorbance values are returned
+
+        Returns
+        -------
+        array
+            Array with one row per frequency, and one column per sample for a
+            2-D `values` input.
+        """
+        frequencies = np.asarray(frequencies, dtype=float)
+        low, high = self.sorted_freq[0], self.sorted_freq[-1]
+        outside = (frequencies < low) | (frequencies > high)
+        if outside.any():
+            raise ValueError(
+                'Frequencies {0} lie outside the measured frequency range '
+                '[{1}, {2}]'.format(frequencies[outside].tolist(), low, high))
+
+        upper = np.searchsorted(self.sorted_freq, frequencies, side='left')
+        upper = np.clip(upper, 1, self.sorted_freq.size - 1)
+        lower = upper - 1
+        f_low = self.sorted_freq[lower]
+        f_high = self.sorted_freq[upper]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(f_high > f_low,
+                              (frequencies - f_low) / (f_high - f_low), 0.0)
+
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 2:
+            weight = weight[:, None]
+        return ((1 - weight) * values[self.order[lower]] +
+                weight * values[self.order[upper]])
+
+
+@lru_cache(maxsize=32)
+def _cached_frequency_index(freq_bytes):
+    """ Returns a `FrequencyIndex` for a frequency axis given as raw bytes """
+    return FrequencyIndex(np.frombuffer(freq_bytes, dtype=float))
+
+
+def frequency_index(freq):
+    """ Returns the (cached) `FrequencyIndex` for the frequency axis `freq`
+
+    The index is cached on the frequency values, so repeated fits of samples
+    sharing one frequency axis only sort the axis once.
+    """
+    freq = np.ascontiguousarray(freq, dtype=float)
+    return _cached_frequency_index(freq.tobytes())
+
+
+@accepts_spectra
+def guess_heights(df, col, center_list, gain=0.95, index=None):
     """ Determines guesses for the heights based on measured data.
 
-    Function creates an integer mapping to the measured frequencies, and then
-    creates an initial peak height guess of gain*actual height at x=freq*. A
-    Default of 0.95 seems to work best for most spectra, but can be change to
-    improve convergence.
+    Function looks up the measured absorbance at each center frequency
+    (linearly interpolating between measured frequencies), and then creates an
+    initial peak height guess of gain*actual height at x=freq*. A Default of
+    0.95 seems to work best for most spectra, but can be change to improve
+    convergence.
 
     Parameters
     ----------
     df : Dataframe
         Dataframe containing the measured absorbance data
 
-    col : string or integer
+    col : string, integer or list
         Column index for the absorbance data being fit. Accepts either index
-        or string convention.
+        or string convention. A list, tuple or Index of columns returns the
+        heights of all the columns in one call.
 
-    center_list : iterable of integers
-        An iterable of integer peak positions used to find the experiment
-        absorbance at a given wavenumber. I.e, the heights are returned at the
-        center values in this iterable
+    center_list : iterable of numbers
+        An iterable of peak positions used to find the experiment absorbance
+        at a given wavenumber. I.e, the heights are returned at the center
+        values in this iterable
 
     gain : number (optional)
         Fraction of the measured absorbance value to use determine the initial
         guess for the peak height. The value Default value is 0.95, and thus
         by default, all initial peak guesses are 95% of the peak max.
 
+    index : FrequencyIndex (optional)
+        Index of the frequency column of `df`. Built (and cached) from the
+        frequency column if not provided.
+
+    Returns
+    -------
+    list or 2-D array
+        List of the height guesses for a single column, or an array with one
+        row per center and one column per sample for a list of columns.
     """
-    heights = []
-    freq_map = {}
-    for i in df.iloc[:,0]:
-        j = math.floor(i)
-        freq_map[j] = float(df[col].get(df.iloc[:,0] == i))
-    for i in center_list:
-        height = freq_map[i]
-        heights.append(gain*height)
-    return heights
+    if index is None:
+        index = frequency_index(df.iloc[:, 0].to_numpy(dtype=float))
+    columns = isinstance(col, (list, tuple, pd.Index))
+    if columns:
+        col = list(col)
+    heights = gain * index.lookup(df[col].to_numpy(dtype=float), center_list)
+    if columns:
+        return heights
+    return heights.tolist()
 
 
 def gaussian(x, height, center, width):
@@ -460,24 +1024,190 @@ def gaussian(x, height, center, width):
     return height*np.exp(-(x - center)**2/(2*width**2))
 
 
+def gaussian_jacobian(x, *args):
+    """ Returns the Jacobian of `gaussian_sum` with respect to its parameters
+
+    The parameters follow the same (height, center, width)_{n} sequence as
+    `gaussian_sum`, and the returned array has one row per `x` value and one
+    column per parameter.
+    """
+    if len(args) % 3 != 0:
+        raise ValueError('Args must divisible by 3')
+    p = np.asarray(args, dtype=float).reshape(-1, 3)
+    height = p[:, 0:1]
+    center = p[:, 1:2]
+    width = p[:, 2:3]
+
+    x = np.asarray(x, dtype=float)
+    diff = x - center
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = diff / width**2
+        exponential = np.exp(-diff * scaled / 2)
+        d_center = height * exponential * scaled
+
+    jacobian = np.empty((x.size, p.size))
+    jacobian[:, 0::3] = exponential.T
+    jacobian[:, 1::3] = d_center.T
+    jacobian[:, 2::3] = (d_center * diff / width).T
+    return jacobian
+
+
+class GaussianWindows(object):
+    """ Gaussian model and sparse Jacobian evaluated within peak windows
+
+    A Gaussian is effectively zero more than a few widths from its center.
+    Each peak is only evaluated at the frequencies within `truncate` maximum
+    widths of its center bounds, so the cost of the model and of its
+    Jacobian grows with the number of peaks times the window size instead
+    of the number of peaks times the spectrum length. The windows cover the
+    whole center bounds, so the sparsity structure is fixed during a fit.
+
+    Parameters
+    ----------
+    x : 1-D array
+        Frequency range for evaluation
+
+    center_bounds : iterable of tuples
+        Lower and upper bound of each peak center, e.g. the `uncertainties`
+        of the peak definitions
+
+    peak_width : Number
+        Maximum peak width
+
+    truncate : Float (default: 6.0)
+        Window half width beyond the center bounds, in maximum peak widths.
+        The truncated tails are below `exp(-truncate**2/2)` of the height.
+    """
+
+    def __init__(self, x, center_bounds, peak_width, truncate=6.0):
+        self.x = np.asarray(x, dtype=float)
+        bounds = np.asarray(center_bounds, dtype=float).reshape(-1, 2)
+        reach = truncate * peak_width
+        inside = ((self.x >= bounds[:, :1] - reach) &
+                  (self.x <= bounds[:, 1:] + reach))
+        self.n_peaks = len(bounds)
+        self.peak, self.rows = np.nonzero(inside)
+        self.x_rows = self.x[self.rows]
+
+        # Fixed CSR structure of the (len(x), 3n) Jacobian. Entries are
+        # stored per peak as (height, center, width) blocks.
+        entries = len(self.rows)
+        rows = np.tile(self.rows, 3)
+        cols = (3 * np.tile(self.peak, 3) +
+                np.repeat(np.arange(3), entries))
+        self.order = np.lexsort((cols, rows))
+        self.indices = cols[self.order]
+        self.indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(rows, minlength=self.x.size))])
+
+    @property
+    def sparsity(self):
+        """ Boolean sparse matrix of the nonzero Jacobian entries, e.g. for
+        the `jac_sparsity` argument of `optimize.least_squares`
+        """
+        from scipy import sparse
+        return sparse.csr_matrix(
+            (np.ones(len(self.indices), dtype=bool), self.indices,
+             self.indptr), shape=(self.x.size, 3 * self.n_peaks))
+
+    def _terms(self, p):
+        p = np.asarray(p, dtype=float).reshape(-1, 3)
+        height, center, width = (p[self.peak, i] for i in range(3))
+        diff = self.x_rows - center
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scaled = diff / width**2
+            exponential = np.exp(-diff * scaled / 2)
+        return height, width, diff, scaled, exponential
+
+    def model(self, p):
+        """ Returns the sum of the windowed peaks, see `gaussian_sum` """
+        height, _, _, _, exponential = self._terms(p)
+        return np.bincount(self.rows, weights=height * exponential,
+                           minlength=self.x.size)
+
+    def jacobian(self, p):
+        """ Returns the sparse (CSR) Jacobian of `model`, with the same
+        layout as `gaussian_jacobian`
+        """
+        from scipy import sparse
+        height, width, diff, scaled, exponential = self._terms(p)
+        d_center = height * exponential * scaled
+        with np.errstate(divide='ignore', invalid='ignore'):
+            d_width = d_center * diff / width
+        data = np.concatenate([exponential, d_center, d_width])
+        return sparse.csr_matrix(
+            (data[self.order], self.indices, self.indptr),
+            shape=(self.x.size, 3 * self.n_peaks))
+
+
+def gaussian_peaks(x, p, out=None):
+    """ Returns every gaussian peak evaluated over `x` in a single broadcast
+
+    Parameters
+    ----------
+    x : 1-D array
+        Frequency range for evaluation
+
+    p : 1-D or 2-D array
+        Peak parameters following the sequence (height, center, width)_{n}.
+        A 2-D array of shape (3n, S) evaluates a batch of S parameter
+        vectors at once, e.g. a differential evolution population.
+
+    out : array (optional)
+        Preallocated buffer of shape (n, len(x)), or (n, len(x), S) for a
+        batch of parameter vectors, to hold the result.
+
+    Returns
+    -------
+    array
+        Peak values with shape (n, len(x)) or (n, len(x), S)
+    """
+    p = np.asarray(p, dtype=float)
+    if p.shape[0] % 3 != 0:
+        raise ValueError('Args must divisible by 3')
+    p = p.reshape((-1, 3) + p.shape[1:])
+    x = np.asarray(x, dtype=float)
+    if p.ndim == 2:
+        height, center, width = (p[:, i, None] for i in range(3))
+    else:
+        x = x[:, None]
+        height, center, width = (p[:, None, i] for i in range(3))
+
+    shape = (p.shape[0],) + x.shape[:1] + p.shape[2:]
+    if out is None:
+        out = np.empty(shape)
+    elif out.shape != shape:
+        raise ValueError('Output buffer must have shape {0}'.format(shape))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.subtract(x, center, out=out)
+        np.divide(out, width, out=out)
+        np.square(out, out=out)
+        np.multiply(out, -0.5, out=out)
+        np.exp(out, out=out)
+        np.multiply(out, height, out=out)
+    return out
+
+
+def gaussian_model(x, p, out=None):
+    """ Returns the sum of the gaussian peaks defined by the parameters `p`
+
+    Vectorized equivalent of `gaussian_sum`. A 2-D parameter array of shape
+    (3n, S) returns the S model curves as columns of a (len(x), S) array.
+    """
+    return gaussian_peaks(x, p, out=out).sum(axis=0)
+
+
 def gaussian_sum(x, *args):
     """ Returns the sum of the gaussian function inputs
     """
-    return sum(gaussian_list(x, *args))
+    return gaussian_model(x, args)
 
 
 def gaussian_list(x, *args):
-    """ Returns the sum of the gaussian function inputs
+    """ Returns a list of the gaussian function inputs
     """
-    if len(args) % 3 != 0:
-        raise ValueError('Args must divisible by 3')
-    gausslist = []
-    count = 0
-    for i in range(int(len(args)/3)):
-        gausstemp = gaussian(x, args[count], args[count+1], args[count+2])
-        gausslist.append(gausstemp)
-        count += 3
-    return gausslist
+    return list(gaussian_peaks(x, args))
 
 
 def gaussian_integral(height, width):
@@ -547,6 +1277,8 @@ def create_fit_plots(raw_df, col, peak_list):
         `plot.show()` or saved as a file image via `plot.save()`
     """
 
+    import matplotlib.pyplot as plt
+
     fig = plt.figure(figsize=(8, 6))
     ax = fig.add_subplot(211)
 
@@ -0,0 +1,229 @@
+""" Array backed container for a set of spectra sharing one frequency axis
+
+The modeling functions traditionally take a pandas DataFrame with the
+frequency data in the first column and one column per sample. `SpectraSet`
+holds the same data as a single float matrix (n_points x n_samples), one
+frequency vector and a table of sample metadata. Column selections and
+frequency crops return views of the same memory, and every modeling function
+decorated with `accepts_spectra` takes a `SpectraSet` in place of a DataFrame.
+"""
+from functools import wraps
+
+import numpy as np
+import pandas as pd
+
+
+def _as_slice(positions):
+    """ Returns an equivalent slice for evenly spaced positions, or `None`
+
+    Basic slices of a numpy array are views, so expressing a selection as a
+    slice avoids copying the selected spectra.
+    """
+    positions = np.asarray(positions, dtype=int)
+    if positions.size == 0:
+        return None
+    if positions.size == 1:
+        return slice(positions[0], positions[0] + 1)
+    steps = np.diff(positions)
+    if steps[0] > 0 and (steps == steps[0]).all():
+        return slice(positions[0], positions[-1] + 1, steps[0])
+    return None
+
+
+class SpectraSet(object):
+    """ Set of spectra sharing one frequency axis
+
+    Parameters
+    ----------
+    freq : 1-D array
+        Frequency (wavenumber) values, one per row of `values`
+
+    values : 2-D array
+        Spectral data with one row per frequency and one column per sample.
+        The array is used as is (no copy) if it is already a float array.
+
+    names : list (optional)
+        Sample names, one per column of `values`. Defaults to the column
+        positions.
+
+    metadata : DataFrame (optional)
+        Sample metadata indexed by sample name.
+
+    freq_name : Str (default: 'freq')
+        Name of the frequency column used when converting to a DataFrame.
+    """
+
+    def __init__(self, freq, values, names=None, metadata=None,
+                 freq_name='freq'):
+        freq = np.asarray(freq, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if values.ndim == 1:
+            values = values[:, None]
+        if freq.ndim != 1 or values.ndim != 2 or len(freq) != len(values):
+            raise ValueError('values must be a 2-D array with one row per '
+                             'frequency. Got frequency shape {0} and values '
+                             'shape {1}'.format(freq.shape, values.shape))
+        if names is None:
+            names = list(range(values.shape[1]))
+        names = list(names)
+        if len(names) != values.shape[1]:
+            raise ValueError('Expected {0} sample names, got {1}'
+                             ''.format(values.shape[1], len(names)))
+        if metadata is None:
+            metadata = pd.DataFrame(index=pd.Index(names, name='sample'))
+
+        self.freq = freq
+        self.values = values
+        self.names = names
+        self.metadata = metadata
+        self.freq_name = freq_name
+
+    @classmethod
+    def from_dataframe(cls, df, freq=0, metadata=None):
+        """ Creates a `SpectraSet` from a DataFrame of spectra
+
+        Parameters
+        ----------
+        df : DataFrame
+            DataFrame with a frequency column and one column per sample
+
+        freq : Int or Str (default: 0)
+            Column name, or column index if not a column name, of the
+            frequency data.
+
+        metadata : DataFrame (optional)
+            Sample metadata indexed by sample name.
+        """
+        if freq not in df.columns and isinstance(freq, int):
+            freq = df.columns[freq]
+        names = [c for c in df.columns if c != freq]
+        return cls(df[freq].to_numpy(dtype=float),
+                   df[names].to_numpy(dtype=float), names=names,
+                   metadata=metadata, freq_name=freq)
+
+    def to_dataframe(self):
+        """ Returns a DataFrame with the frequency in the first column
+
+        The sample columns share memory with `values` where pandas allows it.
+        """
+        df = pd.DataFrame(self.values, columns=self.names, copy=False)
+        df.insert(0, self.freq_name, self.freq)
+        return df
+
+    @property
+    def shape(self):
+        """ (n_points, n_samples) """
+        return self.values.shape
+
+    @property
+    def n_points(self):
+        return self.values.shape[0]
+
+    @property
+    def n_samples(self):
+        return self.values.shape[1]
+
+    def __len__(self):
+        return self.n_samples
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __repr__(self):
+        return '<SpectraSet: {0} samples x {1} points ({2:g}-{3:g})>'.format(
+            self.n_samples, self.n_points, self.freq.min(), self.freq.max())
+
+    def position(self, name):
+        """ Returns the column position of a sample """
+        try:
+            return self.names.index(name)
+        except ValueError:
+            raise KeyError(name)
+
+    def __getitem__(self, key):
+        """ Returns a spectrum, or a `SpectraSet` for a list or slice
+
+        A single sample name returns that spectrum as a 1-D view. A list of
+        sample names or a slice of columns returns a `SpectraSet` viewing the
+        selected spectra; the selection is only copied if the columns cannot
+        be expressed as an evenly spaced slice.
+        """
+        if isinstance(key, slice):
+            return self._subset(key, self.names[key])
+        if isinstance(key, (list, tuple, np.ndarray, pd.Index)):
+            return self.select(key)
+        return self.values[:, self.position(key)]
+
+    def select(self, names):
+        """ Returns a `SpectraSet` of the given samples """
+        names = list(names)
+        positions = [self.position(name) for name in names]
+        columns = _as_slice(positions)
+        if columns is None:
+            columns = positions
+        return self._subset(columns, names)
+
+    def _subset(self, columns, names):
+        """ Returns a `SpectraSet` of the given columns and names """
+        metadata = self.metadata.reindex(names)
+        return SpectraSet(self.freq, self.values[:, columns], names=names,
+                          metadata=metadata, freq_name=self.freq_name)
+
+    def crop(self, min_freq=None, max_freq=None):
+        """ Returns a `SpectraSet` limited to a frequency range (inclusive)
+
+        A view is returned when the frequencies in the range are contiguous
+        rows, which is always the case for sorted frequency data.
+        """
+        mask = np.ones(self.n_points, dtype=bool)
+        if min_freq is not None:
+            mask &= self.freq >= min_freq
+        if max_freq is not None:
+            mask &= self.freq <= max_freq
+        rows = _as_slice(np.flatnonzero(mask))
+        if rows is None:
+            rows = mask
+        return SpectraSet(self.freq[rows], self.values[rows],
+                          names=self.names, metadata=self.metadata,
+                          freq_name=self.freq_name)
+
+    def copy(self):
+        """ Returns a deep copy """
+        return SpectraSet(self.freq.copy(), self.values.copy(),
+                          names=list(self.names), metadata=self.metadata.copy(),
+                          freq_name=self.freq_name)
+
+
+def accepts_spectra(func):
+    """ Decorator allowing a DataFrame based function to take a `SpectraSet`
+
+    If the first argument is a `SpectraSet`, it is passed to `func` as a
+    DataFrame sharing its memory, and a DataFrame result is converted back
+    into a `SpectraSet` carrying over the sample metadata. The metadata is
+    matched by sample name, or by sample position if the function renamed
+    the samples. Other inputs and results are passed
+    through unchanged.
+    """
+    @wraps(func)
+    def wrapper(df, *args, **kwargs):
+        if not isinstance(df, SpectraSet):
+            return func(df, *args, **kwargs)
+        spectra = df
+        result = func(spectra.to_dataframe(), *args, **kwargs)
+        if isinstance(result, pd.DataFrame):
+            result = SpectraSet.from_dataframe(result)
+            metadata = spectra.metadata.reindex(spectra.names)
+            renamed = any(name not in spectra for name in result.names)
+            if renamed and result.n_samples == spectra.n_samples:
+                # The function renamed the samples (e.g. `find_deriv` turns
+                # the names into strings), so match them by position
+                metadata.index = pd.Index(result.names,
+                                          name=metadata.index.name)
+            else:
+                metadata = metadata.reindex(result.names)
+            result.metadata = metadata
+        return result
+    return wrapper
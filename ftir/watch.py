@@ -0,0 +1,247 @@
+"""
+Incremental processing of a folder of newly acquired spectra
+
+Instruments export new files into a shared folder throughout the day.
+`FolderWatcher` polls the folder, runs the `ftir.cli` pipeline on the files
+that are new or changed since they were last processed, and appends their
+results to a csv results store. A json manifest next to the results records
+the size, modification time and content hash of every processed file, so a
+restarted watcher only processes what changed while it was down.
+
+From the command line:
+
+    ftir watch /shared/ftir_exports -o results.csv --interval 30
+"""
+import json
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from ftir.cli import DEFAULTS, find_files, process
+from ftir.io.cache import _file_digest
+
+
+MANIFEST_VERSION = 1
+
+
+def _atomic_write(path, writer, mode='w'):
+    """ Writes a file through a temporary file in the same folder """
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            writer(f)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class Manifest(object):
+    """ Record of the processed files, stored as json
+
+    Each entry holds the `size`, `mtime` and `sha256` of the file when it was
+    processed, the time it was `processed`, its number of `samples`, and the
+    `error` raised while processing it, if any.
+
+    Parameters
+    ----------
+    path : Str
+        Manifest file. Loaded if it exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = dict()
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            if manifest['version'] > MANIFEST_VERSION:
+                raise ValueError('Manifest version {0} is not supported'
+                                 ''.format(manifest['version']))
+            self.entries = manifest['files']
+
+    def is_current(self, path, stat):
+        """ Returns whether a file is unchanged since it was processed,
+        judging by its size and modification time
+        """
+        entry = self.entries.get(os.path.abspath(path))
+        return (entry is not None and entry['size'] == stat.st_size and
+                entry['mtime'] == stat.st_mtime)
+
+    def matches_content(self, path, digest):
+        """ Returns whether a processed file had the given content hash """
+        entry = self.entries.get(os.path.abspath(path))
+        return entry is not None and entry['sha256'] == digest
+
+    def touch(self, path, stat):
+        """ Updates the size and modification time of an entry """
+        entry = self.entries[os.path.abspath(path)]
+        entry.update(size=stat.st_size, mtime=stat.st_mtime)
+
+    def record(self, path, stat, digest, samples=0, error=None):
+        """ Adds or replaces the entry of a processed file """
+        self.entries[os.path.abspath(path)] = {
+            'size': stat.st_size, 'mtime': stat.st_mtime, 'sha256': digest,
+            'processed': time.time(), 'samples': samples,
+            'error': None if error is None else str(error)}
+
+    def save(self):
+        """ Writes the manifest """
+        manifest = {'version': MANIFEST_VERSION, 'files': self.entries}
+        _atomic_write(self.path, lambda f: json.dump(manifest, f, indent=1))
+
+
+def append_results(results, path, replace_files=()):
+    """ Appends results to a csv results store
+
+    Parameters
+    ----------
+    results : DataFrame
+        Results table with a `file` column, e.g. from `ftir.cli.process`
+
+    path : Str
+        csv results store. Created if it does not exist.
+
+    replace_files : Iterable (optional)
+        Files whose previous results are removed from the store, e.g. files
+        that changed since they were processed.
+    """
+    results = results.drop(columns='x', errors='ignore')
+    replace_files = set(replace_files)
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        _atomic_write(path, lambda f: results.to_csv(f, index=False))
+        return
+    header = list(pd.read_csv(path, nrows=0).columns)
+    if not replace_files and header == list(results.columns):
+        results.to_csv(path, mode='a', header=False, index=False)
+        return
+    # Rewrite the store if results are replaced or the columns changed
+    store = pd.read_csv(path)
+    store = store[~store['file'].isin(replace_files)]
+    store = pd.concat([store, results], ignore_index=True)
+    _atomic_write(path, lambda f: store.to_csv(f, index=False))
+
+
+class FolderWatcher(object):
+    """ Polls folders and processes new or changed spectra files
+
+    Parameters
+    ----------
+    inputs : list
+        Folders, files or glob patterns to watch (see `ftir.cli.find_files`)
+
+    results : Str
+        csv results store the results are appended to
+
+    settings : Dict (optional)
+        Pipeline settings, see `ftir.cli.DEFAULTS`
+
+    manifest : Str (optional)
+        Manifest file. Defaults to the results file name with a
+        `.manifest.json` suffix.
+
+    interval : Number (default: 10)
+        Seconds between polls
+
+    settle : Number (default: 2)
+        Seconds a file must be left unmodified before it is processed, so
+        files still being written by the instrument are skipped until the
+        next poll.
+
+    progress : Callable (optional)
+        Called with a message for each processed file and each error
+    """
+
+    def __init__(self, inputs, results, settings=None, manifest=None,
+                 interval=10, settle=2, progress=None):
+        self.inputs = list(inputs)
+        self.results = results
+        self.settings = dict(DEFAULTS, **(settings or dict()))
+        if manifest is None:
+            manifest = os.path.splitext(results)[0] + '.manifest.json'
+        self.manifest = Manifest(manifest)
+        self.interval = interval
+        self.settle = settle
+        self.progress = progress
+
+    def pending(self):
+        """ Returns the new or changed files as a dict of path: (stat,
+        sha256). Files that were only touched, not changed, are updated in
+        the manifest and not returned.
+        """
+        pending = dict()
+        touched = False
+        now = time.time()
+        own_files = {os.path.abspath(self.results),
+                     os.path.abspath(self.manifest.path)}
+        for path in find_files(self.inputs):
+            if os.path.abspath(path) in own_files:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if (self.manifest.is_current(path, stat) or
+                    now - stat.st_mtime < self.settle):
+                continue
+            digest = _file_digest(path)
+            if self.manifest.matches_content(path, digest):
+                self.manifest.touch(path, stat)
+                touched = True
+            else:
+                pending[path] = (stat, digest)
+        if touched:
+            self.manifest.save()
+        return pending
+
+    def poll(self):
+        """ Processes the new or changed files once
+
+        Files that fail are recorded in the manifest with their error, so
+        they are only processed again once they change.
+
+        Returns the results of the processed files.
+        """
+        pending = self.pending()
+        if not pending:
+            return pd.DataFrame(columns=['file', 'sample'])
+        files = sorted(pending)
+        changed = [os.path.abspath(path) for path in files
+                   if os.path.abspath(path) in self.manifest.entries]
+        try:
+            results, errors = process(files, self.settings, self.progress)
+        except Exception as e:
+            results = pd.DataFrame(columns=['file', 'sample'])
+            errors = {path: e for path in files}
+            if self.progress is not None:
+                self.progress('Error: {0}'.format(e))
+        results['file'] = results['file'].map(os.path.abspath)
+        results['processed'] = pd.Timestamp.now().isoformat(
+            timespec='seconds')
+        try:
+            append_results(results, self.results, replace_files=changed)
+            samples = results['file'].value_counts()
+            for path in files:
+                stat, digest = pending[path]
+                self.manifest.record(
+                    path, stat, digest,
+                    int(samples.get(os.path.abspath(path), 0)),
+                    errors.get(path))
+        finally:
+            self.manifest.save()
+        return results
+
+    def run(self, once=False):
+        """ Polls until interrupted (`KeyboardInterrupt`), or once """
+        while True:
+            self.poll()
+            if once:
+                return
+            try:
+                time.sleep(self.interval)
+            except KeyboardInterrupt:
+                return
@@ -34,5 +34,7 @@ setup(
     requires=[],
     # Additional data files
     data_files=[(".", ["README.md"])],
-    entry_points={},
+    entry_points={
+        'console_scripts': ['ftir = ftir.cli:main'],
+    },
 )
@@ -0,0 +1,113 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ftir.io.archive import SpectralArchive
+from ftir.modeling.area_norm import area_norm
+from ftir.modeling.batch_fitting import fit_all
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def example():
+    return pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+
+
+@pytest.fixture
+def archive(tmp_path, example):
+    archive = SpectralArchive.create(str(tmp_path / 'archive'),
+                                     example['freq'])
+    names = list(example.columns[1:])
+    dates = pd.date_range('2020-01-01', periods=len(names), freq='D')
+    archive.append_dataframe(
+        example, [{'date': str(date), 'batch': i % 2}
+                  for i, date in enumerate(dates)])
+    return archive
+
+
+def test_append_and_select(archive, example):
+    names = list(example.columns[1:])
+    assert len(archive) == len(names)
+    assert list(archive.index['name']) == names
+
+    selected = archive.select([names[3], names[0]])
+    assert list(selected.names) == [names[3], names[0]]
+    np.testing.assert_array_equal(selected.values,
+                                  example[[names[3], names[0]]].to_numpy())
+
+    odd = archive.select(batch=1)
+    assert list(odd.names) == names[1::2]
+    assert list(odd.metadata['batch']) == [1] * len(names[1::2])
+
+    dated = archive.select(start='2020-01-02', end='2020-01-03')
+    assert list(dated.names) == names[1:3]
+
+    with pytest.raises(KeyError):
+        archive.select(['missing'])
+
+
+def test_append_a_single_spectrum(archive, example):
+    spectrum = example.iloc[:, 1].to_numpy() * 2
+    archive.append(spectrum, 'double', {'batch': 2})
+    selected = archive.select(batch=2)
+    assert list(selected.names) == ['double']
+    np.testing.assert_array_equal(selected.values[:, 0], spectrum)
+
+    with pytest.raises(ValueError):
+        archive.append(spectrum[:-1], 'short')
+
+
+def test_reopen(archive, example):
+    reopened = SpectralArchive(archive.directory)
+    assert len(reopened) == len(archive)
+    np.testing.assert_array_equal(reopened.freq, example['freq'])
+    np.testing.assert_array_equal(reopened.spectra().values,
+                                  example.iloc[:, 1:].to_numpy())
+    pd.testing.assert_frame_equal(reopened.index, archive.index)
+
+
+def test_interrupted_append_is_ignored(archive, example):
+    count = len(archive)
+    # The spectra of an append were written, but its index line was cut off
+    with open(os.path.join(archive.directory, 'spectra.dat'), 'ab') as f:
+        f.write(np.ones(len(example)).tobytes())
+    with open(os.path.join(archive.directory, 'index.jsonl'), 'a') as f:
+        f.write('{"name": "cut')
+
+    reopened = SpectralArchive(archive.directory)
+    assert len(reopened) == count
+
+    spectrum = example.iloc[:, 1].to_numpy() * 3
+    reopened.append(spectrum, 'triple')
+    reopened = SpectralArchive(archive.directory)
+    assert len(reopened) == count + 1
+    assert reopened.index['name'].iloc[-1] == 'triple'
+    np.testing.assert_array_equal(reopened.select(['triple']).values[:, 0],
+                                  spectrum)
+
+
+def test_corrupt_index_line_raises(archive):
+    with open(os.path.join(archive.directory, 'index.jsonl'), 'a') as f:
+        f.write('not json\n')
+    with pytest.raises(ValueError):
+        SpectralArchive(archive.directory)
+
+
+def test_selection_feeds_the_modeling_functions(archive, example):
+    names = list(example.columns[1:4])
+    selected = archive.select(names)
+    expected = example[['freq'] + names]
+
+    normalized = area_norm(selected)
+    np.testing.assert_allclose(normalized.values,
+                               area_norm(expected).iloc[:, 1:].to_numpy())
+
+    results = fit_all(selected, workers=1)
+    reference = fit_all(expected, workers=1)
+    assert list(results.index) == names
+    pd.testing.assert_frame_equal(results.drop(columns='x'),
+                                  reference.drop(columns='x'))
@@ -0,0 +1,73 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import integrate
+
+from ftir.modeling.area_norm import area_norm
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _column_area_norm(df, min_freq=-np.inf, max_freq=np.inf):
+    """ Previous per-column implementation of `area_norm`, integrating
+    between `min_freq` and `max_freq`
+    """
+    df = df.copy()
+    inside = (df.iloc[:, 0] >= min_freq) & (df.iloc[:, 0] <= max_freq)
+    for col in df.columns[1:]:
+        area = integrate.simpson(df.loc[inside, col], x=df.iloc[:, 0][inside])
+        df[col] = df[col] / abs(area)
+    return df
+
+
+@pytest.fixture
+def spectra():
+    return pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+
+
+def test_full_range_matches_column_normalization(spectra):
+    original = spectra.copy()
+    normalized = area_norm(spectra)
+    pd.testing.assert_frame_equal(normalized, _column_area_norm(spectra),
+                                  rtol=1e-12)
+    # The input is left unchanged
+    pd.testing.assert_frame_equal(spectra, original)
+
+
+def test_window_covering_the_spectra_is_the_full_range(spectra):
+    freq = spectra['freq']
+    pd.testing.assert_frame_equal(
+        area_norm(spectra, min_freq=freq.min(), max_freq=freq.max()),
+        area_norm(spectra), rtol=1e-12)
+
+
+@pytest.mark.parametrize('min_freq, max_freq', [(1620, 1680), (None, 1650),
+                                                (1650, None)])
+def test_window_normalizes_the_area_inside(spectra, min_freq, max_freq):
+    normalized = area_norm(spectra, min_freq=min_freq, max_freq=max_freq)
+    expected = _column_area_norm(
+        spectra, -np.inf if min_freq is None else min_freq,
+        np.inf if max_freq is None else max_freq)
+    pd.testing.assert_frame_equal(normalized, expected, rtol=1e-12)
+    # The whole spectra are kept, but only the window has unit area
+    assert normalized.shape == spectra.shape
+    assert not np.allclose(normalized.iloc[:, 1:],
+                           area_norm(spectra).iloc[:, 1:])
+
+
+def test_trapezoid_method(spectra):
+    normalized = area_norm(spectra, method='trapezoid')
+    x = spectra['freq'].to_numpy()
+    for col in spectra.columns[1:]:
+        np.testing.assert_allclose(
+            abs(integrate.trapezoid(normalized[col], x=x)), 1)
+
+
+def test_invalid_window_and_method_raise(spectra):
+    with pytest.raises(ValueError):
+        area_norm(spectra, min_freq=2000, max_freq=2100)
+    with pytest.raises(NameError):
+        area_norm(spectra, method='romberg')
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ftir.modeling.batch_fitting import fit_all, fit_global, fit_series
+from ftir.modeling.peak_definitions import yang_h20_2015
+from ftir.modeling.peak_fitting import gaussian_sum
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _example():
+    return pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+
+
+@pytest.mark.parametrize('method', ['least_squares', 'minimize'])
+def test_cost_is_the_residual_sum_of_squares(method):
+    df = _example()
+    results = fit_all(df, method=method, cols=list(df.columns[1:3]),
+                      workers=1)
+    for col, row in results.iterrows():
+        residuals = gaussian_sum(df['freq'].to_numpy(), *row['x']) - df[col]
+        np.testing.assert_allclose(row['cost'], (residuals**2).sum())
+
+
+def test_fit_series_is_no_worse_than_cold_fits():
+    df = _example()
+    cold = fit_all(df, workers=1)
+    series = fit_series(df)
+    assert series['success'].all()
+    assert series['nfev'].sum() <= cold['nfev'].sum()
+    assert series['cost'].sum() <= cold['cost'].sum()
+    assert not series['warm_start'].iloc[0]
+    assert series['warm_start'].any()
+
+
+@pytest.mark.parametrize('share_widths', [True, False])
+def test_fit_global_is_close_to_separate_fits(share_widths):
+    df = _example()
+    separate = fit_all(df, workers=1)
+    joint = fit_global(df, share_widths=share_widths)
+    areas = [col for col in joint.columns if col.startswith('area_')]
+    structures = sorted(set(yang_h20_2015['assignments']))
+
+    assert np.isfinite(joint[areas].to_numpy()).all()
+    np.testing.assert_allclose(joint[areas].sum(axis=1),
+                               separate[areas].sum(axis=1), rtol=0.25)
+    assert (joint[areas].max(axis=1) < 2 * separate[areas].max(axis=1)).all()
+    assert (joint[structures] - separate[structures]).abs().max().max() < 0.1
+    for x in joint['x']:
+        assert x[2::3].min() >= 0.5
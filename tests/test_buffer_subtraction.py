@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ftir.io.utils import create_df_from_multiple_files
+from ftir.modeling.buffer_subtraction import (
+    WINDOW_MAX, WINDOW_MIN, WINDOW_SIZE, _rolling_mean,
+    find_buffer_subtraction_constant, find_buffer_subtraction_constants)
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _objective(df, sample, c):
+    """ Objective of `find_buffer_subtraction_constant` with the defaults """
+    sub = df[sample] - c * df['buffer']
+    trunc = sub[(df['freq'] < WINDOW_MAX) & (df['freq'] > WINDOW_MIN)]
+    smoothed = trunc.rolling(min_periods=1, center=True,
+                             window=WINDOW_SIZE).mean()
+    return abs(smoothed.max() - smoothed.min())
+
+
+@pytest.fixture(scope='module')
+def spectra():
+    df, _ = create_df_from_multiple_files(
+        [os.path.join(DATA, 'Buffer.txt'), os.path.join(DATA, 'Rep2.txt')])
+    # Scaled and shifted copies of the sample as further samples
+    df['Rep2_scaled'] = 0.9 * df['Rep2'] + 0.05 * df['buffer']
+    df['Rep2_shifted'] = df['Rep2'] + 0.01
+    return df
+
+
+@pytest.mark.parametrize('window, min_periods',
+                         [(1, 1), (4, 1), (5, 2), (12, 1), (12, 12),
+                          (13, 7), (50, 30)])
+def test_rolling_mean_matches_pandas(window, min_periods):
+    values = np.random.default_rng(0).normal(size=(40, 3))
+    expected = pd.DataFrame(values).rolling(
+        window, min_periods=min_periods, center=True).mean().to_numpy()
+    np.testing.assert_allclose(_rolling_mean(values, window, min_periods),
+                               expected, equal_nan=True)
+
+
+def test_batch_constants_do_not_increase_objective(spectra):
+    samples = ['Rep2', 'Rep2_scaled', 'Rep2_shifted']
+    constants = find_buffer_subtraction_constants(spectra, samples, 'buffer')
+    for sample, constant in zip(samples, constants):
+        previous = find_buffer_subtraction_constant(spectra, sample,
+                                                    'buffer')[0]
+        assert (_objective(spectra, sample, constant) <=
+                _objective(spectra, sample, previous) + 1e-12)
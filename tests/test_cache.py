@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from ftir.io.cache import SpectraCache
+
+
+def test_round_trip(tmp_path):
+    cache = SpectraCache(str(tmp_path))
+    df = pd.DataFrame({'freq': np.arange(5), 'a': np.linspace(0, 1, 5)})
+    assert cache.put('key', df, extra=['a'])
+    cached, extra = cache.get('key')
+    pd.testing.assert_frame_equal(cached, df)
+    assert extra == ['a']
+
+
+def test_unstorable_columns_leave_no_files(tmp_path):
+    cache = SpectraCache(str(tmp_path))
+    df = pd.DataFrame(np.ones((3, 2)),
+                      columns=[pd.Timestamp('2020-01-01'),
+                               pd.Timestamp('2020-01-02')])
+    assert not cache.put('key', df)
+    assert os.listdir(str(tmp_path)) == []
+    assert cache.get('key') is None
@@ -0,0 +1,36 @@
+import os
+
+import pandas as pd
+
+from ftir.cli import main
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def test_process_writes_results(tmp_path):
+    output = str(tmp_path / 'results.csv')
+    status = main(['process',
+                   os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'),
+                   '-o', output, '--workers', '1'])
+    assert status == 0
+    results = pd.read_csv(output)
+    assert len(results) == 7
+    assert results['success'].all()
+
+
+def test_process_keeps_results_of_good_files(tmp_path):
+    df = pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+    folder = tmp_path / 'spectra'
+    folder.mkdir()
+    df.to_csv(str(folder / 'good.csv'), index=False)
+    # Too narrow to hold the peak definitions, so its fit fails
+    df[df['freq'] > 1660].to_csv(str(folder / 'narrow.csv'), index=False)
+
+    output = str(tmp_path / 'results.csv')
+    status = main(['process', str(folder), '-o', output, '--workers', '1'])
+    assert status == 1
+    results = pd.read_csv(output)
+    assert len(results) == 7
+    assert set(results['file']) == {str(folder / 'good.csv')}
+    assert results['success'].all()
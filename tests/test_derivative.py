@@ -0,0 +1,120 @@
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse
+from scipy.signal import savgol_filter
+from scipy.sparse.linalg import spsolve
+from scipy.spatial import ConvexHull
+
+from ftir.modeling.derivative import (
+    als_baseline, find_deriv, rubberband_baseline, sd_baseline_correction)
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _spsolve_asym_baseline(y, lam=10**2.5, p=0.007, niter=10):
+    """ Previous `spsolve` implementation of `als_baseline` """
+    L = len(y)
+    D = sparse.diags([1., -2., 1.], [0, -1, -2], shape=(L, L - 2))
+    w = np.ones(L)
+    for i in range(niter):
+        W = sparse.spdiags(w, 0, L, L)
+        Z = W + lam * D.dot(D.transpose())
+        z = spsolve(Z, w * y)
+        w = p * (y > z) + (1 - p) * (y < z)
+    return z
+
+
+def _convex_hull_rubberband(x, y):
+    """ Previous `ConvexHull` implementation of the rubberband correction """
+    v = ConvexHull(np.column_stack([x, y])).vertices
+    if x[0] < x[1]:
+        v = np.roll(v, -v.argmin())
+        v = v[:v.argmax() + 1]
+    else:
+        v = np.roll(v, -v.argmax())
+        v = v[:v.argmin() + 1]
+    return y - np.interp(x, x[v], y[v])
+
+
+@pytest.fixture(scope='module')
+def spectra():
+    return pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+
+
+def test_asym_correction_returns_the_baseline(spectra):
+    corrected = sd_baseline_correction(spectra, method='asym',
+                                       bounds=[1600, 1700])
+    inside = spectra[(spectra['freq'] > 1600) & (spectra['freq'] < 1700)]
+    for col in spectra.columns[1:]:
+        np.testing.assert_allclose(
+            corrected[col], _spsolve_asym_baseline(inside[col].to_numpy()),
+            rtol=0, atol=1e-12)
+
+
+def test_als_baseline_matches_spsolve(spectra):
+    values = spectra.iloc[:, 1:].to_numpy()
+    baselines = als_baseline(values)
+    for i in range(values.shape[1]):
+        expected = _spsolve_asym_baseline(values[:, i])
+        np.testing.assert_allclose(baselines[:, i], expected,
+                                   rtol=0, atol=1e-12)
+        np.testing.assert_allclose(als_baseline(values[:, i]), expected,
+                                   rtol=0, atol=1e-12)
+
+
+def test_als_baseline_does_not_warn():
+    # A length not used by the other tests, so the penalty is not cached
+    y = np.sin(np.linspace(0, 3, 37))
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        als_baseline(y)
+
+
+@pytest.mark.parametrize('descending', [True, False])
+def test_rubberband_baseline_matches_convex_hull(spectra, descending):
+    freq = spectra['freq'].to_numpy()
+    values = -spectra.iloc[:, 1:].to_numpy()
+    if not descending:
+        freq, values = freq[::-1], values[::-1]
+    _, corrected = rubberband_baseline(freq, values)
+    for i in range(values.shape[1]):
+        np.testing.assert_allclose(
+            corrected[:, i], _convex_hull_rubberband(freq, values[:, i]),
+            rtol=0, atol=1e-12)
+
+
+def test_rubberband_baseline_of_a_convex_spectrum():
+    # Every point but the last is on the lower hull of the convex curve
+    x = np.arange(500, dtype=float)
+    y = (x / len(x))**2
+    y[-1] = -10
+    _, corrected = rubberband_baseline(x, y)
+    np.testing.assert_allclose(corrected, _convex_hull_rubberband(x, y),
+                               rtol=0, atol=1e-12)
+
+
+def test_rubberband_baseline_of_a_line():
+    x = np.linspace(1700, 1600, 50)
+    _, corrected = rubberband_baseline(x, np.column_stack([2*x, -x]))
+    np.testing.assert_allclose(corrected, 0, atol=1e-9)
+
+
+@pytest.mark.parametrize('flip', [True, False])
+def test_find_deriv_matches_per_column_filter(spectra, flip):
+    deriv = find_deriv(spectra, flip=flip, window_length=5)
+    # As before, `_deriv` is dropped from the sample names
+    assert list(deriv.columns) == [
+        col.replace('_deriv', '') for col in spectra.columns]
+    for i, col in enumerate(spectra.columns[1:], 1):
+        expected = savgol_filter(spectra[col], deriv=2, window_length=5,
+                                 polyorder=3)
+        if flip:
+            expected = -expected
+            expected = expected - _spsolve_asym_baseline(expected)
+        np.testing.assert_allclose(deriv.iloc[:, i], expected,
+                                   rtol=0, atol=1e-12)
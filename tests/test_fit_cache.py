@@ -0,0 +1,50 @@
+import numpy as np
+
+from ftir.modeling.fit_cache import fit_key
+from ftir.modeling.peak_definitions import yang_h20_2015
+from ftir.modeling.peak_fitting import gaussian_least_squares
+
+
+X = np.linspace(1705, 1600, 20)
+
+
+def _key(**params):
+    return fit_key(X, np.sin(X), yang_h20_2015, 5, gaussian_least_squares,
+                   params)
+
+
+def test_lambdas_get_different_keys():
+    assert _key(jac=lambda p, x, y: 2 * p) != _key(jac=lambda p, x, y: 3 * p)
+
+
+def test_functions_of_the_same_name_get_different_keys():
+    def jac(p, x, y):
+        return p
+
+    first = _key(jac=jac)
+
+    def jac(p, x, y):  # noqa: F811
+        return -p
+
+    assert _key(jac=jac) != first
+
+
+def test_closures_and_defaults_are_part_of_the_key():
+    def scaled(scale):
+        return lambda p, x, y: scale * p
+
+    def shifted(shift):
+        def jac(p, x, y, shift=shift):
+            return p + shift
+        return jac
+
+    assert _key(jac=scaled(2)) != _key(jac=scaled(3))
+    assert _key(jac=scaled(2)) == _key(jac=scaled(2))
+    assert _key(jac=shifted(1)) != _key(jac=shifted(2))
+
+
+def test_same_callable_gets_the_same_key():
+    def jac(p, x, y):
+        return p
+
+    assert _key(jac=jac) == _key(jac=jac)
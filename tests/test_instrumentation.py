@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+import pytest
+
+from ftir.modeling.instrumentation import (
+    Recorder, add_callback, enabled, instrumented, remove_callback)
+
+
+@instrumented
+def scale(values, factor=2.0, label='x'):
+    """ Scales the values """
+    return np.asarray(values) * factor
+
+
+@instrumented(stage='outer')
+def outer(values):
+    time.sleep(0.01)
+    return scale(values, factor=3.0)
+
+
+@instrumented
+def fail(values):
+    raise KeyError('missing')
+
+
+def test_passes_arguments_and_return_values():
+    values = np.arange(6).reshape(3, 2)
+    np.testing.assert_array_equal(scale(values, 3.0), values * 3)
+    with Recorder():
+        np.testing.assert_array_equal(scale(values, factor=0.5),
+                                      values * 0.5)
+    assert scale.__name__ == 'scale'
+    assert scale.__doc__ == ' Scales the values '
+
+
+def test_records_calls_and_timing():
+    values = np.ones((4, 3))
+    with Recorder() as recorder:
+        scale(values, label='y')
+        outer(values)
+        outer(values)
+    assert not enabled()
+
+    stages = [record['stage'] for record in recorder.records]
+    assert stages == ['scale', 'scale', 'outer', 'scale', 'outer']
+    first = recorder.records[0]
+    assert first['input_shape'] == (4, 3)
+    assert first['output_shape'] == (4, 3)
+    assert first['params'] == {'label': 'y'}
+    assert first['depth'] == 0
+    assert first['error'] is None
+    assert recorder.records[1]['depth'] == 1
+    assert recorder.records[1]['params'] == {'factor': 3.0}
+
+    summary = recorder.summary()
+    assert summary.loc['outer', 'count'] == 2
+    assert summary.loc['scale', 'count'] == 3
+    assert summary.loc['outer', 'mean'] >= 0.01
+    assert summary.index[0] == 'outer'
+
+
+def test_records_and_raises_exceptions():
+    with Recorder() as recorder:
+        with pytest.raises(KeyError):
+            fail(np.ones(3))
+    record, = recorder.records
+    assert record['stage'] == 'fail'
+    assert 'missing' in record['error']
+    assert record['output_shape'] is None
+    with pytest.raises(KeyError):
+        fail(np.ones(3))
+
+
+def test_callbacks():
+    records = list()
+    callback = add_callback(records.append)
+    try:
+        assert enabled()
+        scale([1.0, 2.0])
+    finally:
+        remove_callback(callback)
+    scale([1.0, 2.0])
+    assert [record['stage'] for record in records] == ['scale']
+    assert not enabled()
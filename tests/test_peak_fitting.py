@@ -0,0 +1,152 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import optimize
+
+from ftir.modeling.peak_definitions import yang_h20_2015
+from ftir.modeling.peak_fitting import (
+    GaussianWindows, gaussian_differential_evolution, gaussian_jacobian,
+    gaussian_least_squares, gaussian_multistart, gaussian_sum,
+    gaussian_variable_projection, guess_heights, secondary_structure)
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_gaussian_jacobian_matches_finite_differences(seed):
+    rng = np.random.default_rng(seed)
+    x = np.linspace(1705, 1600, 106)
+    n = len(yang_h20_2015['means'])
+    p = np.column_stack([rng.uniform(0.01, 0.2, n),
+                         np.asarray(yang_h20_2015['means']) +
+                         rng.uniform(-2, 2, n),
+                         rng.uniform(2, 6, n)]).ravel()
+
+    numeric = np.array([
+        optimize.approx_fprime(p, lambda q, i=i: gaussian_sum(x, *q)[i],
+                               1e-7)
+        for i in range(len(x))])
+    np.testing.assert_allclose(gaussian_jacobian(x, *p), numeric,
+                               rtol=0, atol=1e-6)
+
+
+@pytest.mark.parametrize('columns', [list, tuple, pd.Index])
+def test_guess_heights_of_several_columns(columns):
+    df = pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+    names = list(df.columns[1:4])
+    means = yang_h20_2015['means']
+    heights = guess_heights(df, columns(names), means)
+    assert heights.shape == (len(means), len(names))
+    for i, name in enumerate(names):
+        np.testing.assert_allclose(heights[:, i],
+                                   guess_heights(df, name, means))
+
+
+def test_multistart_with_one_start_is_the_default_fit():
+    df = pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+    col = df.columns[1]
+    areas, res = gaussian_multistart(df, col, starts=1)
+    expected, _ = gaussian_least_squares(df, col)
+    assert res.starts == 1
+    np.testing.assert_allclose(areas, expected)
+
+
+def test_multistart_requires_a_start():
+    df = pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+    with pytest.raises(ValueError):
+        gaussian_multistart(df, df.columns[1], starts=0)
+
+
+def test_differential_evolution_without_polish():
+    df = pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+    col = df.columns[1]
+    params = {'seed': 0, 'maxiter': 5}
+    _, res = gaussian_differential_evolution(df, col, params=params,
+                                             polish=False)
+    _, polished = gaussian_differential_evolution(df, col, params=params)
+    assert 'jac' not in res
+    assert res.nfev < polished.nfev
+    assert polished.fun <= res.fun
+
+
+def _resample(df, step):
+    """ Linearly interpolates the spectra onto an ascending grid """
+    freq = df['freq'].to_numpy()
+    order = np.argsort(freq)
+    grid = np.arange(freq.min(), freq.max(), step)
+    resampled = pd.DataFrame({'freq': grid})
+    for col in df.columns[1:]:
+        resampled[col] = np.interp(grid, freq[order],
+                                   df[col].to_numpy()[order])
+    return resampled
+
+
+@pytest.mark.parametrize('step', [None, 1.5, 4])
+def test_variable_projection_matches_least_squares(step):
+    df = pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+    if step is not None:
+        df = _resample(df, step)
+    for col in df.columns[1:]:
+        areas, res = gaussian_variable_projection(df, col)
+        expected, _ = gaussian_least_squares(df, col)
+        assert np.isfinite(areas).all()
+        assert res.x[2::3].min() >= 0.5
+        np.testing.assert_allclose(np.sum(areas), np.sum(expected), rtol=0.25)
+        structure = secondary_structure(areas, yang_h20_2015)
+        reference = secondary_structure(expected, yang_h20_2015)
+        for name, fraction in structure.items():
+            assert abs(fraction - reference[name]) < 0.1
+
+
+def test_windowed_jacobian_matches_finite_differences():
+    rng = np.random.default_rng(0)
+    # A wide range, so most peaks are only evaluated within their windows
+    x = np.linspace(1800, 1500, 400)
+    n = len(yang_h20_2015['means'])
+    p = np.column_stack([rng.uniform(0.01, 0.2, n),
+                         np.asarray(yang_h20_2015['means']) +
+                         rng.uniform(-2, 2, n),
+                         rng.uniform(2, 5, n)]).ravel()
+    windows = GaussianWindows(x, yang_h20_2015['uncertainties'], 5,
+                              truncate=6)
+
+    jacobian = windows.jacobian(p)
+    assert jacobian.nnz < 0.5 * jacobian.shape[0] * jacobian.shape[1]
+    numeric = np.array([
+        optimize.approx_fprime(p, lambda q, i=i: windows.model(q)[i], 1e-7)
+        for i in range(len(x))])
+    np.testing.assert_allclose(jacobian.toarray(), numeric,
+                               rtol=0, atol=1e-6)
+    # The truncated tails are below exp(-18) of the heights
+    np.testing.assert_allclose(jacobian.toarray(), gaussian_jacobian(x, *p),
+                               rtol=0, atol=1e-8)
+    np.testing.assert_allclose(windows.model(p), gaussian_sum(x, *p),
+                               rtol=0, atol=1e-8)
+
+
+@pytest.mark.parametrize('params', [{}, {'jac': '2-point'}])
+def test_windowed_fit_matches_the_full_fit(params):
+    # Well separated peaks over a wide range, so the fits have one minimum
+    means = [1450., 1500., 1550., 1600., 1650., 1700.]
+    peaks = {'means': means,
+             'uncertainties': [(mean - 5, mean + 5) for mean in means],
+             'assignments': ['peak'] * len(means)}
+    x = np.linspace(1800, 1400, 800)
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+        n = len(means)
+        p = np.column_stack([rng.uniform(0.02, 0.2, n),
+                             np.asarray(means) + rng.uniform(-3, 3, n),
+                             rng.uniform(2, 4.5, n)]).ravel()
+        df = pd.DataFrame({'freq': x, 'spectrum': gaussian_sum(x, *p) +
+                           rng.normal(0, 1e-3, len(x))})
+        areas, res = gaussian_least_squares(df, 'spectrum', peaks=peaks,
+                                            params=params, truncate=6)
+        expected, reference = gaussian_least_squares(
+            df, 'spectrum', peaks=peaks, params=params)
+        assert res.success
+        np.testing.assert_allclose(areas, expected, rtol=1e-3)
+        np.testing.assert_allclose(res.cost, reference.cost, rtol=1e-6)
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from ftir.modeling.derivative import find_deriv, sd_baseline_correction
+from ftir.spectra import SpectraSet
+
+
+def _spectra(names):
+    freq = np.linspace(1800, 1500, 120)
+    values = np.random.default_rng(0).normal(size=(len(freq), len(names)))
+    metadata = pd.DataFrame({'buffer': ['a', 'b', 'c']},
+                            index=pd.Index(names, name='sample'))
+    return SpectraSet(freq, values, names=names, metadata=metadata)
+
+
+def test_metadata_follows_renamed_samples():
+    spectra = _spectra([0, 1, 2])
+    deriv = find_deriv(spectra, flip=False)
+    assert deriv.names == ['0', '1', '2']
+    assert deriv.metadata['buffer'].tolist() == ['a', 'b', 'c']
+    assert deriv.metadata.index.tolist() == deriv.names
+
+
+def test_metadata_of_selected_samples():
+    spectra = _spectra(['x', 'y', 'z'])
+    corrected = sd_baseline_correction(spectra, cols=['z', 'x'],
+                                       bounds=[1550, 1750])
+    assert corrected.names == ['z', 'x']
+    assert corrected.metadata['buffer'].tolist() == ['c', 'a']
+
+
+def test_metadata_of_reordered_samples():
+    spectra = _spectra(['x', 'y', 'z'])
+    corrected = sd_baseline_correction(spectra, cols=['z', 'y', 'x'],
+                                       bounds=[1550, 1750])
+    assert corrected.metadata['buffer'].tolist() == ['c', 'b', 'a']
@@ -0,0 +1,117 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from ftir.watch import FolderWatcher
+
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+@pytest.fixture
+def example():
+    return pd.read_csv(os.path.join(DATA, 'ExampleBSA_IgG1_2ndDer_AmideI.csv'))
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'exports'
+    folder.mkdir()
+    return folder
+
+
+def _watcher(tmp_path, folder):
+    return FolderWatcher([str(folder)], str(tmp_path / 'results.csv'),
+                         {'workers': 1}, settle=0)
+
+
+def _touch(path, seconds):
+    """ Moves the modification time of a file `seconds` into the past """
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime - seconds))
+    return stat.st_mtime - seconds
+
+
+def _manifest(tmp_path):
+    with open(str(tmp_path / 'results.manifest.json')) as f:
+        return json.load(f)['files']
+
+
+def test_new_and_unchanged_files(tmp_path, folder, example):
+    path = str(folder / 'plate.csv')
+    example.to_csv(path, index=False)
+    watcher = _watcher(tmp_path, folder)
+
+    results = watcher.poll()
+    assert len(results) == 7
+    assert set(results['file']) == {os.path.abspath(path)}
+    assert len(pd.read_csv(str(tmp_path / 'results.csv'))) == 7
+    entry = _manifest(tmp_path)[os.path.abspath(path)]
+    assert entry['samples'] == 7
+    assert entry['error'] is None
+
+    assert watcher.poll().empty
+    # A restarted watcher reads the manifest and skips the file as well
+    assert _watcher(tmp_path, folder).poll().empty
+    assert len(pd.read_csv(str(tmp_path / 'results.csv'))) == 7
+
+
+def test_touched_and_changed_files(tmp_path, folder, example):
+    path = str(folder / 'plate.csv')
+    example.to_csv(path, index=False)
+    watcher = _watcher(tmp_path, folder)
+    watcher.poll()
+
+    mtime = _touch(path, 10)
+    assert watcher.poll().empty
+    assert _manifest(tmp_path)[os.path.abspath(path)]['mtime'] == mtime
+
+    example.iloc[:, :4].to_csv(path, index=False)
+    _touch(path, 20)
+    results = watcher.poll()
+    assert len(results) == 3
+    # The results of the previous version of the file are replaced
+    store = pd.read_csv(str(tmp_path / 'results.csv'))
+    assert len(store) == 3
+
+
+def test_failing_files_are_recorded(tmp_path, folder, example):
+    good = str(folder / 'good.csv')
+    narrow = str(folder / 'narrow.csv')
+    example.to_csv(good, index=False)
+    # Too narrow to hold the peak definitions, so its fit fails
+    example[example['freq'] > 1660].to_csv(narrow, index=False)
+    watcher = _watcher(tmp_path, folder)
+
+    results = watcher.poll()
+    assert set(results['file']) == {os.path.abspath(good)}
+    manifest = _manifest(tmp_path)
+    assert manifest[os.path.abspath(good)]['error'] is None
+    assert manifest[os.path.abspath(narrow)]['samples'] == 0
+    assert 'frequency range' in manifest[os.path.abspath(narrow)]['error']
+
+    # The failing file is not retried until it changes
+    assert watcher.poll().empty
+    example.to_csv(narrow, index=False)
+    _touch(narrow, 10)
+    results = watcher.poll()
+    assert set(results['file']) == {os.path.abspath(narrow)}
+    assert _manifest(tmp_path)[os.path.abspath(narrow)]['error'] is None
+
+
+def test_manifest_is_saved_when_processing_fails(tmp_path, folder, example,
+                                                 monkeypatch):
+    path = str(folder / 'plate.csv')
+    example.to_csv(path, index=False)
+
+    def process(files, settings, progress=None):
+        raise MemoryError('out of memory')
+
+    monkeypatch.setattr('ftir.watch.process', process)
+    watcher = _watcher(tmp_path, folder)
+    assert watcher.poll().empty
+    assert 'out of memory' in _manifest(tmp_path)[os.path.abspath(path)][
+        'error']
+    assert watcher.poll().empty